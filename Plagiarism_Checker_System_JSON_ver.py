@@ -12,20 +12,43 @@ Returns:
 """
 
 import json
+import os
 import re
 import requests
 import pandas as pd
-import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
-nltk.download('punkt')
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from tensorflow.keras.preprocessing.text import Tokenizer
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from plagiarism_tokenizer import sent_tokenize, word_tokenize, cleaner_namespace
+from plagiarism_similarity import tokenizing, vecTfid, count_flag, document_vectors, chapter_bounds, prefilter_bounds
+from plagiarism_index import load_index, build_index, add_chapter, build_exact_index, exact_matches, refresh_in_background
+from plagiarism_store import open_store, store_tfid, store_token, Selection
+from plagiarism_lsh import build_lsh, query_lsh
+from plagiarism_winnow import build_winnow, query_winnow
+from plagiarism_preprocess import make_cache, clean_texts
+from plagiarism_matches import make_matches, add_matches, iter_details, opp_fic_ids
 
 import warnings
 warnings.filterwarnings('ignore')
 
+# Cleaning patterns of remove, compiled once
+QUOTES = re.compile(r'[\“\”\‘\’\"\']')
+SYMBOLS = re.compile(r'[\-\–\—\/?!_,.()\[\]:;]')
+
+# Cache key of the cleaned lines (with the punkt model, see cleaner_namespace), change it whenever remove or get_list changes
+CLEANER = 'json-remove-v1'
+preprocess_cache = make_cache()
+
+# Corpora with fewer chapters are compared serially, the process pool overhead would dominate
+PARALLEL_MIN_CHAPTERS = 256
+
+# Chapters scoring this much (or more) against another fiction block the upload
+PLAG_THRESHOLD = 0.3
+
+# Read-only corpus of the comparison workers, set once per worker by set_corpus
+corpus = ()
+
 def request(story_url='https://readscape.live/pdftodatabase'):
     """
     Requesting and loading data from database.
@@ -51,239 +74,710 @@ def remove(text):
     Returns:
         words (str): cleaned text.
     """
-    pattern = r'[\“\”\‘\’\"\']'
-    sub_text = re.sub(pattern, '', text)
-    pattern = r'[\-\–\—\/?!_,.()\[\]:;]'
-    sub_text = re.sub(pattern, ' ', sub_text)
-    token_text = word_tokenize(sub_text)
+    sub_text = QUOTES.sub('', text)
+    sub_text = SYMBOLS.sub(' ', sub_text)
+    # '.', '?' and '!' are gone, so the text is already a single sentence for word_tokenize
+    token_text = word_tokenize(sub_text, preserve_line=True)
     words = [word for word in token_text if word]
     words = ' '.join(words)
     return words
 
-def text_list(story_data):
+def get_list(story):
     """
-    Creating the text array.
+    Cleaning the text of one story line by line.
 
     Args:
-        story_data (pd.Dataframe): story texts from database.
+        story (str): story text.
 
     Returns:
-        lists (array): list of cleaned texts.
+        list_arr (array): cleaned lines of the story.
     """
-    lists = []
-    for _, row in story_data.iterrows():
-        list_arr = []
-        text_to_line = sent_tokenize(row[-4].lower())
-        for text in text_to_line:
-            list_arr.append(remove(text))
-        lists.append(list_arr)
-    return lists
-
-def tokenizing(flat_text,text):
+    list_arr = []
+    text_to_line = sent_tokenize(story.lower())
+    for text in text_to_line:
+        list_arr.append(remove(text))
+    return list_arr
+
+def text_list(story_data, cache=preprocess_cache, workers=1):
     """
-    Tokenizing the texts.
+    Creating the text array, stories already in the cache are not cleaned again.
 
     Args:
-        flat_text (array): flatted texts from all story.
-        text (array): original array of the texts.
+        story_data (pd.Dataframe): story texts from database.
+        cache (dict): preprocessing cache, None to clean every story.
+        workers (int): number of worker processes for the stories missing from the cache, None for every core.
 
     Returns:
-        tokenid (array): tokenized texts.
-    """
-    tokenizer = Tokenizer()
-    tokenizer.fit_on_texts(flat_text)
-    word_index = tokenizer.word_index
-    tokenid = []
-    for i in text:
-        tokens = tokenizer.texts_to_sequences(i)
-        tokenid.append(tokens)
-    return tokenid
-
-def vecTfid(flat_text, text):
+        lists (array): list of cleaned texts.
     """
-    Vectorizing the texts.
+    return clean_texts(story_data.iloc[:,-4].tolist(), get_list, cache, cleaner_namespace(CLEANER), workers)
 
-    Args:
-        flat_text (array): flatted texts from all story.
-        text (array): original array of the texts.
+def unreachable_bounds(tf_bound, token_bound):
+  """
+  Finding the chapters that cannot flag any line, from the bounds of prefilter_bounds.
 
-    Returns:
-        vecarr (array): vectorized texts.
-    """
-    vec = TfidfVectorizer()
-    vec.fit(flat_text)
-    vecarr = []
-    for i in text:
-        transform = vec.transform(i).toarray()
-        vecarr.append(transform)
-    return vecarr
-
-def add_values(story_dict, line_key, values, ori_id, opp_id):
-    """
-    Creating the similar text lines dictionary.
+  A chapter is unreachable when its tfidf bound is <=0.35 and its token bound <0.9999 (no tfidf match, no token copy),
+  or when its token bound is <=0.7 and its tfidf bound <0.9999 (no token match, no tfidf copy).
 
-    Args:
-        story_dict (dictionary): the dictionary to be used.
-        key (str): text line of the story being checked.
-        values (array): array of the text lines from the other story that has high similarity with key line.
-        id (array): fiction_id and chapter_id of the other story.
+  Args:
+      tf_bound (np.ndarray): bound of the tfidf similarity of every chapter.
+      token_bound (np.ndarray): bound of the token similarity of every chapter.
 
-    Returns:
-        story_dict (dictionary): the dictionary filled with new values.
-    """
-    # Define the fiction and chapter id
-    ori_fic_id, ori_chap_id = ori_id
-    opp_fic_id, opp_chap_id = opp_id
+  Returns:
+      unreachable (np.ndarray): True for every chapter that can be skipped.
+  """
+  # Small margin, the bounds and the line similarity are not summed in the same order
+  tf_bound = tf_bound + 1e-9
+  token_bound = token_bound + 1e-9
+  return ((tf_bound <= 0.35) & (token_bound < 0.9999)) | ((token_bound <= 0.7) & (tf_bound < 0.9999))
 
-    # Set the dictionary
-    story_dict.setdefault(ori_fic_id, {}).setdefault(ori_chap_id, {}).setdefault(line_key, {}).setdefault(opp_fic_id, {}).setdefault(opp_chap_id, [])
+def prune_chapters(ids, tfid, token, cid, chapters, bounds, keep=None):
+  """
+  Finding the chapters that cannot flag any line of the chapter being checked, from chapter level bounds
+  (unreachable_bounds).
 
-    # Adding the lines into each dictionary keys
-    for line in values:
-        if line not in story_dict[ori_fic_id][ori_chap_id][line_key][opp_fic_id][opp_chap_id]:
-            story_dict[ori_fic_id][ori_chap_id][line_key][opp_fic_id][opp_chap_id].append(line)
+  Args:
+      ids (array): fiction_id and chapter_id of every chapter.
+      tfid (array): vectorized texts.
+      token (array): tokenized texts.
+      cid (int): position of the chapter being checked.
+      chapters (array): positions of the chapters to compare with.
+      bounds (dict): chapter level data from chapter_bounds.
+      keep (set): chapters with verbatim copies or copied passages, always compared.
 
-def count_flag(token1, token2, tf1, tf2, story_dict, text1, text2, ori_id, opp_id):
+  Returns:
+      pruned (set): positions of the chapters that can be skipped.
   """
-  Detecting lines with high similarity.
+  if not tfid[cid].shape[0]:
+    return set()
+  unreachable = unreachable_bounds(*prefilter_bounds(bounds, tfid[cid], token[cid]))
+  return {j for j in chapters if unreachable[j] and ids[j][0] != ids[cid][0] and not (keep and j in keep)}
+
+def corpus_args(corpus_data):
+  """
+  Getting the arguments of set_corpus for the worker processes of a corpus.
 
   Args:
-      token1 (array): the tokenized array of the story being checked.
-      token2 (array): the tokenized array of the other story.
-      tf1 (array): the vectorized array of the story being checked.
-      tf2 (array): the vectorized array of the other story.
-      story_dict (dictionary): the dictionary to be called in add_values function
-      text1 (str): text of the story being checked.
-      text2 (str): text of the other story.
-      id (array): fiction_id and chapter_id of the other story
+      corpus_data (dict): corpus from prepare_corpus or prepare_index.
 
   Returns:
-      plag_tf_token (int): number of lines with similarity >0.35 and <0.9999
-      di (int): total number of line in the story being checked.
-      hs (int): number of line with vectorized similarity >0.9999
-      cp (int): number of line with tokenized similarity >0.9999
-  """
-  # Defining all necessary flag variables
-  plag_tf_token = 0
-  di = len(tf1)
-  token_cos = []
-  cp = 0
-  hs = 0
-
-  # Getting the similarity on Tokenized text and Vectorized text
-  tf_cos = cosine_similarity(tf1,tf2)
-  for i in range(len(token1)):
-    cos_line= []
-    for j in range(len(token2)):
-      cos = len(set(token1[i])&set(token2[j]))/len(list(set(token1[i]+token2[j])))
-      cos_line.append(cos)
-    token_cos.append(cos_line)
-
-  # Iterating through all the line
-  for i in range(di):
-    tf = 0
-
-    # For high similarity checking
-    if any(vals >= 0.9999 for vals in tf_cos[i]):
-      tryis = [index for index, vals in enumerate(tf_cos[i]) if vals >= 0.9999]
-      add_values(story_dict, text1[i],[text2[i] for i in tryis], ori_id, opp_id)
-      hs+=1
-    elif any(0.35 < vals < 0.9999 for vals in tf_cos[i]):
-      tryish = [index for index, vals in enumerate(tf_cos[i]) if 0.35 < vals < 0.9999]
-      tf = 1
-
-    # For high structure similarity checking
-    if any(vals >= 0.9999 for vals in token_cos[i]):
-      tryis = [index for index, vals in enumerate(token_cos[i]) if vals >= 0.9999]
-      add_values(story_dict, text1[i],[text2[i] for i in tryis], ori_id, opp_id)
-      cp+=1
-    elif any(0.7 < vals < 0.9999 for vals in token_cos[i]):
-      tryis = [index for index, vals in enumerate(token_cos[i]) if 0.7 < vals < 0.9999]
-      if tf == 1:
-        plag_tf_token += 1
-        add_values(story_dict, text1[i],[text2[i] for i in tryis], ori_id, opp_id)
-        add_values(story_dict, text1[i],[text2[i] for i in tryish], ori_id, opp_id)
-      
-  return plag_tf_token, di, hs, cp
-    
-def main_code(story_data,text_list):
+      data (array): ids, text_list, tfid and token of every chapter, or the store directory, the store position of
+      every chapter, ids and the chapters missing from the store when the corpus comes from a memory-mapped store.
   """
-  Main code of the system, checking the newly uploaded story checked against other stories in database.
+  ids, tfid, token = corpus_data['ids'], corpus_data['tfid'], corpus_data['token']
+  store = corpus_data.get('store')
+  if store is None:
+    return ids, corpus_data['text'], tfid, token
+
+  # Workers map the store themselves, only the chapters appended after it was written are sent
+  extra = {k: (tfid[k], token[k]) for k, p in enumerate(store['positions']) if p >= store['chapters']}
+  return store['dir'], store['positions'], ids, extra
+
+def set_corpus(*data):
+  """
+  Setting the read-only corpus of a comparison worker.
 
   Args:
-      story_data (pd.DataFrame): Data loaded from database.
+      data (array): ids, text_list, tfid and token of every chapter, or the store form from corpus_args
+      (the workers then share the pages of the mapped store, the cleaned text is not needed by them).
+  """
+  global corpus
+  if isinstance(data[0], str):
+    store_dir, positions, ids, extra = data
+    store = open_store(store_dir)
+    tfid = [extra[k][0] if k in extra else store_tfid(store, p) for k, p in enumerate(positions)]
+    token = [extra[k][1] if k in extra else store_token(store, p) for k, p in enumerate(positions)]
+    data = (ids, None, tfid, token)
+  corpus = data
+
+def compare_chapters(data, cid, chapters, candidates=None, exact=None, passages=None):
+  """
+  Comparing the chapter being checked with some chapters of the corpus.
+
+  Args:
+      data (array): ids, text_list, tfid and token of every chapter.
+      cid (int): position of the chapter being checked.
+      chapters (array): positions of the chapters to compare with.
+      candidates (dict): chapter position -> candidate line positions from query_lsh, None to compare every line.
+      exact (dict): chapter position -> verbatim copies from exact_matches, None to find the copies with the similarity matrices.
+      passages (dict): chapter position -> copied passages from query_winnow, None to only compare the lines.
+
+  Returns:
+      results (array): (plag_score, flagged lines) of each chapter, plag_score is None for skipped chapters.
+  """
+  ids, text_list, tfid, token = data
+  exact = exact or {}
+  passages = passages or {}
+  results = []
+  for j in chapters:
+    flagged = []
+    plag_score = None
+    copies = exact.get(j)
+
+    # Skip chapter text of same story
+    if candidates is not None:
+      # Only the candidate lines of the candidate chapters are compared
+      if ids[cid][0] != ids[j][0] and j in candidates:
+        lines = candidates[j]
+        # Verbatim copies always share their buckets, only their position among the candidates changes
+        if copies:
+          copies = {i: np.searchsorted(lines, found).tolist() for i, found in copies.items()}
+        plag_ft, di, hs, cp = count_flag(token[cid], [token[j][k] for k in lines], tfid[cid], tfid[j][lines], flagged, copies)
+        plag_score = (plag_ft+(hs+cp)/2)/di
+        # Back to the lines of the whole chapter
+        flagged = [(i, lines[found]) for i, found in flagged]
+    elif ids[cid][0] != ids[j][0]:
+      plag_ft, di, hs, cp = count_flag(token[cid], token[j], tfid[cid], tfid[j], flagged, copies)
+      plag_score = (plag_ft+(hs+cp)/2)/di
+
+    # Lines of copied passages that count_flag missed (merged, split or reordered sentences) count as plagiarised lines
+    if ids[cid][0] != ids[j][0] and j in passages:
+      found = {i for i, _ in flagged}
+      extra = [(i, opp) for i, opp in passages[j].items() if i not in found]
+      plag_score = (plag_score or 0) + len(extra) / tfid[cid].shape[0]
+      flagged += extra
+
+    # Flagged lines in the order count_flag found them
+    results.append((plag_score, [(i, np.asarray(found, dtype=np.int64)) for i, found in flagged]))
+  return results
+
+def compare_worker(task):
+  """
+  Comparing a chunk of chapters inside a worker process.
+
+  Args:
+      task (array): cid, chapter positions, candidates, copies and passages of the chunk.
+
+  Returns:
+      results (array): results of compare_chapters.
+  """
+  return compare_chapters(corpus, *task)
+
+def chapter_results(ids, text_list, tfid, token, cid=-1, candidates=None, workers=1, exact=None, pool=None, bounds=None, telemetry=None, passages=None):
+  """
+  Comparing one chapter against every other chapter, each result is given as soon as its chapter is compared.
+
+  Args:
+      ids (array): fiction_id and chapter_id of every chapter.
       text_list (array): list of cleaned text.
+      tfid (array): vectorized texts.
+      token (array): tokenized texts.
+      cid (int): position of the chapter being checked.
+      candidates (dict): chapter position -> candidate line positions from query_lsh, None to compare every line.
+      workers (int): number of worker processes, None for every core, small corpora are always compared serially.
+      exact (dict): exact copy index of the corpus (cleaned line -> fiction_id, chapter_id and line), None to find the copies with the similarity matrices.
+      pool (ProcessPoolExecutor): pool already started with set_corpus on this corpus, reused instead of starting one.
+      bounds (dict): chapter level data from chapter_bounds, computed when not given.
+      telemetry (dict): filled with the number of chapters, pruned chapters and compared chapters of the check.
+      passages (dict): chapter position -> copied passages from query_winnow, None to only compare the lines.
 
   Returns:
-      final (json): final similarity score and whether the file is safe to be uploaded or not.
-      details (json): lines with high similarity and the related works.
+      results (generator): (chapter position, plag_score, flagged lines) of every chapter in chapter order,
+      plag_score is None for skipped chapters. Closing the generator cancels the pending comparisons.
   """
-  # Flattened the text to smooth out the tokenize and vectorize
-  flat_text = [line for text in text_list for line in text]
+  data = (ids, text_list, tfid, token)
+  workers = os.cpu_count() if workers is None else workers
+
+  # Verbatim copies of the checked lines from hash lookups
+  copies = None
+  if exact is not None:
+    copies = exact_matches(exact, text_list[cid], {(str(fic_id), str(chap_id)): pos for pos, (fic_id, chap_id) in enumerate(ids)})
+
+  # Chapters that cannot reach the thresholds score 0 without building the line matrices
+  if bounds is None:
+    bounds = chapter_bounds(tfid, token)
+  others = [j for j in range(len(token)) if ids[j][0] != ids[cid][0] and (candidates is None or j in candidates)]
+  pruned = prune_chapters(ids, tfid, token, cid, others, bounds, set(copies or ()) | set(passages or ()))
+  chapters = [j for j in range(len(token)) if j not in pruned]
+  if telemetry is not None:
+    telemetry.update({'chapters': len(others), 'pruned': len(pruned), 'compared': len(others) - len(pruned)})
+
+  own = None
+  if pool is not None or (workers > 1 and len(chapters) >= PARALLEL_MIN_CHAPTERS):
+    # Several chunks per worker to even out long and short chapters
+    size = -(-len(chapters) // (max(workers, 1) * 4))
+    chunks = [chapters[k:k + size] for k in range(0, len(chapters), size)]
+    tasks = [(cid, chunk, None if candidates is None else {j: candidates[j] for j in chunk if j in candidates},
+              None if copies is None else {j: copies[j] for j in chunk if j in copies},
+              None if passages is None else {j: passages[j] for j in chunk if j in passages}) for chunk in chunks]
+    if pool is None:
+      pool = own = ProcessPoolExecutor(workers, initializer=set_corpus, initargs=data)
+    # Executor.map hands the chunks back in order, each one as soon as it is done
+    results = (result for part in pool.map(compare_worker, tasks) for result in part)
+  else:
+    results = (compare_chapters(data, cid, [j], candidates, copies, passages)[0] for j in chapters)
 
-  # Calling the tokenizer and vectorizer function
-  tfid = vecTfid(flat_text,text_list)
-  token = tokenizing(flat_text,text_list)
+  try:
+    for j in range(len(token)):
+      score, flagged = (0.0, []) if j in pruned else next(results)
+      yield j, score, flagged
+  finally:
+    if own is not None:
+      own.shutdown(cancel_futures=True)
 
+def check_chapter(ids, text_list, tfid, token, cid=-1, candidates=None, workers=1, exact=None, pool=None, bounds=None, telemetry=None, passages=None, progress=None):
+  """
+  Checking one chapter against every other chapter.
+
+  Args:
+      ids (array): fiction_id and chapter_id of every chapter.
+      text_list (array): list of cleaned text.
+      tfid (array): vectorized texts.
+      token (array): tokenized texts.
+      cid (int): position of the chapter being checked.
+      candidates (dict): chapter position -> candidate line positions from query_lsh, None to compare every line.
+      workers (int): number of worker processes, None for every core, small corpora are always compared serially.
+      exact (dict): exact copy index of the corpus (cleaned line -> fiction_id, chapter_id and line), None to find the copies with the similarity matrices.
+      pool (ProcessPoolExecutor): pool already started with set_corpus on this corpus, reused instead of starting one.
+      bounds (dict): chapter level data from chapter_bounds, computed when not given.
+      telemetry (dict): filled with the number of chapters, pruned chapters and compared chapters of the check.
+      passages (dict): chapter position -> copied passages from query_winnow, None to only compare the lines.
+      progress (function): called with (opp_fic_id, opp_chap_id, plag_score, matches, running max score) after
+          every compared chapter, the check is cancelled when it returns True.
+
+  Returns:
+      final (json): final similarity score and whether the file is safe to be uploaded or not.
+      details (json): lines with high similarity and the related works.
+      (None when the check was cancelled by progress)
+  """
   plag_score = 0
   fin_plag_score = 0
   verdict = ""
   YN = 0
-  story_dict = {}
-  cid = -1
 
-  # Iterating each text to examine the similarity between text
-  for j in range(len(token)):
-    # Skip chapter text of same story
-    if story_data.iloc[cid,1] != story_data.iloc[j,1]:
-      plag_ft, di, hs, cp = count_flag(token[cid], token[j], tfid[cid], tfid[j], story_dict, text_list[cid], text_list[j], story_data.iloc[cid,1:3], story_data.iloc[j,1:3])
-      plag_score = (plag_ft+(hs+cp)/2)/di
+  # Merging in chapter order gives the same matches as comparing serially
+  matches = make_matches(text_list[cid])
+  results = chapter_results(ids, text_list, tfid, token, cid, candidates, workers, exact, pool, bounds, telemetry, passages)
+  for j, score, flagged in results:
+    if score is not None:
+      plag_score = score
     if plag_score > fin_plag_score:
       fin_plag_score = plag_score
+    for line, found in flagged:
+      add_matches(matches, line, j, found, text_list[j])
+
+    if progress is not None and score is not None:
+      if progress(ids[j][0], ids[j][1], score, chapter_matches(text_list, cid, j, flagged), fin_plag_score):
+        results.close()
+        return None
 
-  if fin_plag_score >= 0.3:
+  if fin_plag_score >= PLAG_THRESHOLD:
     YN = 1
     verdict = "Unfortunately, your plagiarism score has exceeded the maximum percentage. Please revise and try again."
   else:
     YN = 0
     verdict = "Congratulations, your plagiarism score is within safe percentage! You may upload your work!"
 
-  if len(story_dict) == 0:
-    add_values(story_dict, '-', '-', story_data.iloc[cid,1:3], ['-', '-'])
+  final = {'final_plag_score': round(fin_plag_score * 100, 2), 'yes_or_no': YN, 'verdict': verdict,
+           'ori_fic_id': ids[cid][0], 'opp_fic_id': opp_fic_ids(matches, ids)}
+
+  details = ''.join(iter_details(matches, ids, text_list, cid))
+  final = json.dumps(final)
+
+  return final, details
+
+def chapter_matches(text_list, cid, j, flagged):
+  """
+  Getting the flagged lines of one compared chapter as text.
+
+  Args:
+      text_list (array): list of cleaned text.
+      cid (int): position of the chapter being checked.
+      j (int): position of the other chapter.
+      flagged (array): (line, matched lines) from compare_chapters.
+
+  Returns:
+      matches (array): (line of the checked chapter, similar lines of the other chapter) of every flagged line.
+  """
+  return [(text_list[cid][i], [text_list[j][k] for k in found]) for i, found in flagged]
+
+def stream_chapter(ids, text_list, tfid, token, cid=-1, candidates=None, workers=1, exact=None, pool=None, bounds=None, passages=None):
+  """
+  Streaming the comparison of one chapter, for progress bars and partial matches.
+
+  Args:
+      ids (array): fiction_id and chapter_id of every chapter.
+      text_list (array): list of cleaned text.
+      tfid (array): vectorized texts.
+      token (array): tokenized texts.
+      cid (int): position of the chapter being checked.
+      candidates (dict): chapter position -> candidate line positions from query_lsh, None to compare every line.
+      workers (int): number of worker processes, None for every core.
+      exact (dict): exact copy index of the corpus, None to find the copies with the similarity matrices.
+      pool (ProcessPoolExecutor): pool already started with set_corpus on this corpus.
+      bounds (dict): chapter level data from chapter_bounds, computed when not given.
+      passages (dict): chapter position -> copied passages from query_winnow, None to only compare the lines.
+
+  Returns:
+      results (generator): (opp_fic_id, opp_chap_id, plag_score, matches, running max score) of every chapter of the
+      other fictions, in chapter order. Stop iterating (or close the generator) to cancel the check.
+  """
+  fin_plag_score = 0
+  results = chapter_results(ids, text_list, tfid, token, cid, candidates, workers, exact, pool, bounds, None, passages)
+  try:
+    for j, score, flagged in results:
+      if score is None:
+        continue
+      fin_plag_score = max(fin_plag_score, score)
+      yield ids[j][0], ids[j][1], score, chapter_matches(text_list, cid, j, flagged), fin_plag_score
+  finally:
+    results.close()
+
+def check_verdict(ids, text_list, tfid, token, cid=-1, candidates=None, exact=None, documents=None, bounds=None, telemetry=None, passages=None):
+  """
+  Checking only whether the chapter can be uploaded, stopping at the first chapter over the threshold.
+
+  The chapters of other fictions are compared from the most similar document down, so a plagiarised upload
+  usually stops after a few chapters. The score is the first one over the threshold (not the maximum), and
+  the maximum of every chapter when the upload is safe.
+
+  Args:
+      ids (array): fiction_id and chapter_id of every chapter.
+      text_list (array): list of cleaned text.
+      tfid (array): vectorized texts.
+      token (array): tokenized texts.
+      cid (int): position of the chapter being checked.
+      candidates (dict): chapter position -> candidate line positions from query_lsh, None to compare every line.
+      exact (dict): exact copy index of the corpus, None to find the copies with the similarity matrices.
+      documents (sparse.csr_matrix): document vectors of every chapter, computed when not given.
+      bounds (dict): chapter level data from chapter_bounds, computed when not given.
+      telemetry (dict): filled with the number of chapters, pruned chapters and compared chapters of the check.
+      passages (dict): chapter position -> copied passages from query_winnow, None to only compare the lines.
 
-  data = [{'ori_fic_id': ori_fic_id, 'ori_chap_id': ori_chap_id, 'ori_line': key, 'opp_fic_id': opp_fic_id, 'opp_chap_id': opp_chap_id, 'sim_line': value}
-        for ori_fic_id, chap_id in story_dict.items()
-        for ori_chap_id, key_dict in chap_id.items()
-        for key, file_dict in key_dict.items()
-        for opp_fic_id, chap_dict in file_dict.items()
-        for opp_chap_id, value in chap_dict.items()]
+  Returns:
+      final (json): final similarity score and whether the file is safe to be uploaded or not.
+      details (None): no details are built in this mode.
+  """
+  cid = cid % len(ids)
+  data = (ids, text_list, tfid, token)
+  if documents is None:
+    documents = document_vectors(tfid)
+
+  # Most similar chapters of other fictions first
+  doc_sim = (documents @ documents[cid].T).toarray().ravel()
+  chapters = [j for j in np.argsort(-doc_sim, kind='stable') if ids[j][0] != ids[cid][0]]
+  passages = passages or {}
+  if candidates is not None:
+    chapters = [j for j in chapters if j in candidates or j in passages]
+
+  copies = {}
+  if exact is not None:
+    copies = exact_matches(exact, text_list[cid], {(str(fic_id), str(chap_id)): pos for pos, (fic_id, chap_id) in enumerate(ids)})
+
+  # Chapters that cannot reach the thresholds score 0
+  if bounds is None:
+    bounds = chapter_bounds(tfid, token)
+  pruned = prune_chapters(ids, tfid, token, cid, chapters, bounds, set(copies) | set(passages))
+  if telemetry is not None:
+    telemetry.update({'chapters': len(chapters), 'pruned': len(pruned), 'compared': 0})
+  chapters = [j for j in chapters if j not in pruned]
 
-  df = pd.DataFrame(data)
-  df_e = df.explode('sim_line')
-  df_e.reset_index(drop=True, inplace=True)
+  fin_plag_score = 0
+  opp_fic_id = ['-']
+  for j in chapters:
+    [(score, _)] = compare_chapters(data, cid, [int(j)], candidates, {j: copies[j]} if j in copies else None,
+                                    {j: passages[j]} if j in passages else None)
+    if telemetry is not None:
+      telemetry['compared'] += 1
+    fin_plag_score = max(fin_plag_score, score)
+    if score >= PLAG_THRESHOLD:
+      opp_fic_id = [ids[j][0]]
+      break
+
+  if fin_plag_score >= PLAG_THRESHOLD:
+    YN = 1
+    verdict = "Unfortunately, your plagiarism score has exceeded the maximum percentage. Please revise and try again."
+  else:
+    YN = 0
+    verdict = "Congratulations, your plagiarism score is within safe percentage! You may upload your work!"
 
   final = {'final_plag_score': round(fin_plag_score * 100, 2), 'yes_or_no': YN, 'verdict': verdict,
-           'ori_fic_id': story_data.iloc[cid,1], 'opp_fic_id': [id['opp_fic_id'] for id in data]}
+           'ori_fic_id': ids[cid][0], 'opp_fic_id': opp_fic_id}
+  return json.dumps(final), None
 
-  details = df_e.to_json()
-  final = json.dumps(final)
+def lsh_candidates(text_list, cid=-1, lsh=None):
+  """
+  Getting the candidate lines of the chapter being checked with MinHash / LSH.
 
-  return final, details
+  Args:
+      text_list (array): list of cleaned text.
+      cid (int): position of the chapter being checked.
+      lsh (dict): LSH index of text_list, built when not given.
+
+  Returns:
+      candidates (dict): chapter position -> candidate line positions.
+  """
+  if lsh is None:
+    lsh = build_lsh(text_list)
+  return query_lsh(lsh, text_list[cid], exclude=cid % len(text_list))
+
+def prepare_corpus(story_data, text_list):
+  """
+  Vectorizing and tokenizing the whole corpus once.
+
+  Args:
+      story_data (pd.DataFrame): Data loaded from database.
+      text_list (array): list of cleaned text.
+
+  Returns:
+      corpus_data (dict): ids, cleaned text, vectorized and tokenized texts and exact copy index of every chapter.
+  """
+  return vectorize_corpus(list(story_data.iloc[:,1:3].itertuples(index=False, name=None)), text_list)
+
+def vectorize_corpus(ids, text_list):
+  """
+  Vectorizing and tokenizing cleaned chapters from any source (plagiarism_engine loaders).
+
+  Args:
+      ids (array): fiction_id and chapter_id of every chapter.
+      text_list (array): list of cleaned text.
+
+  Returns:
+      corpus_data (dict): ids, cleaned text, vectorized and tokenized texts and exact copy index of every chapter.
+  """
+  # Flattened the text to smooth out the tokenize and vectorize
+  flat_text = [line for text in text_list for line in text]
+
+  # Calling the tokenizer and vectorizer function
+  tfid = vecTfid(flat_text,text_list)
+  token = tokenizing(flat_text,text_list)
+  return {'ids': ids, 'text': text_list, 'tfid': tfid, 'token': token, 'exact': build_exact_index(ids, text_list)}
+
+def prepare_index(story_data, index_dir, workers=None, cache=preprocess_cache):
+  """
+  Getting the corpus from the persistent index, only chapters missing from the index are cleaned and vectorized.
+
+  Args:
+      story_data (pd.DataFrame): Data loaded from database.
+      index_dir (str): directory of the corpus index.
+      workers (int): number of worker processes for cleaning, None for every core.
+      cache (dict): preprocessing cache.
+
+  Returns:
+      corpus_data (dict): ids, cleaned text, vectorized and tokenized texts and exact copy index of every chapter.
+  """
+  ids = list(story_data.iloc[:,1:3].itertuples(index=False, name=None))
+  keys = [(str(fic_id), str(chap_id)) for fic_id, chap_id in ids]
+
+  # First run builds the index from the whole database
+  index = load_index(index_dir)
+  if index is None:
+    index = build_index(index_dir, keys, text_list(story_data, cache, workers))
+
+  # Afterwards only the new chapters (the upload) are cleaned and added
+  position = dict(index['positions'])
+  new = [pos for pos, key in enumerate(keys) if key not in position]
+  for pos, lines in zip(new, text_list(story_data.iloc[new], cache, workers)):
+    position[keys[pos]] = add_chapter(index, keys[pos][0], keys[pos][1], lines)
+
+  # The chapters currently in the database, in the same order as story_data
+  order = [position[key] for key in keys]
+  corpus_data = {'ids': ids, 'text': Selection(index['text'], order), 'tfid': Selection(index['tfid'], order),
+                 'token': Selection(index['token'], order), 'exact': index['exact']}
+  if index.get('store') is not None:
+    corpus_data['store'] = {'dir': index['store']['dir'], 'chapters': index['store']['chapters'], 'positions': order}
+  return corpus_data
+
+def check_corpus(corpus_data, cids, lsh=False, workers=None, verdict_only=False, telemetry=None, winnow=False, progress=None):
+  """
+  Checking several chapters against the prepared corpus, the corpus is only vectorized, indexed and sent to the workers once.
 
-def Plagiarism_Checker(data):
+  Args:
+      corpus_data (dict): corpus from prepare_corpus or prepare_index, its bounds, documents, lsh and winnow indexes
+      are used when it already carries them (the warm corpus of plagiarism_service).
+      cids (array): positions of the chapters being checked.
+      lsh (bool): only compare the candidate lines found by MinHash / LSH.
+      workers (int): number of worker processes, None for every core.
+      verdict_only (bool): only decide the upload verdict, stopping early and without details.
+      telemetry (array): list filled with the prefilter counts (chapters, pruned, compared) of each check.
+      winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+      progress (function): called with (opp_fic_id, opp_chap_id, plag_score, matches, running max score) after every compared chapter, returning True cancels the check.
+
+  Returns:
+      results (array): final and details json of each checked chapter, None for a cancelled check.
+  """
+  ids, texts, tfid, token = corpus_data['ids'], corpus_data['text'], corpus_data['tfid'], corpus_data['token']
+  lsh_index = (corpus_data.get('lsh') or build_lsh(texts)) if lsh else None
+  winnow_index = (corpus_data.get('winnow') or build_winnow(texts)) if winnow else None
+  workers = os.cpu_count() if workers is None else workers
+  bounds = corpus_data.get('bounds') or chapter_bounds(tfid, token)
+
+  def stats():
+    if telemetry is None:
+      return None
+    telemetry.append({})
+    return telemetry[-1]
+
+  def copied(cid):
+    return query_winnow(winnow_index, texts[cid], exclude=cid % len(texts)) if winnow else None
+
+  if verdict_only:
+    documents = corpus_data.get('documents')
+    if documents is None:
+      documents = document_vectors(tfid)
+    return [check_verdict(ids, texts, tfid, token, cid, lsh_candidates(texts, cid, lsh_index) if lsh else None,
+                          corpus_data['exact'], documents, bounds, stats(), copied(cid)) for cid in cids]
+
+  def check(cid, pool=None):
+    candidates = lsh_candidates(texts, cid, lsh_index) if lsh else None
+    return check_chapter(ids, texts, tfid, token, cid, candidates, workers, corpus_data['exact'], pool, bounds, stats(), copied(cid), progress)
+
+  # A corpus with a store always starts its own pool, the workers map the store instead of receiving the corpus
+  if (len(cids) > 1 or 'store' in corpus_data) and workers > 1 and len(token) >= PARALLEL_MIN_CHAPTERS:
+    with ProcessPoolExecutor(workers, initializer=set_corpus, initargs=corpus_args(corpus_data)) as pool:
+      return [check(cid, pool) for cid in cids]
+  return [check(cid) for cid in cids]
+
+def stream_corpus(corpus_data, cid=-1, lsh=False, workers=None, winnow=False):
+  """
+  Streaming the check of one chapter of the prepared corpus.
+
+  Args:
+      corpus_data (dict): corpus from prepare_corpus or prepare_index.
+      cid (int): position of the chapter being checked.
+      lsh (bool): only compare the candidate lines found by MinHash / LSH.
+      workers (int): number of worker processes, None for every core.
+      winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+
+  Returns:
+      results (generator): (opp_fic_id, opp_chap_id, plag_score, matches, running max score) of every chapter of the
+      other fictions, stop iterating to cancel the check.
+  """
+  ids, texts, tfid, token = corpus_data['ids'], corpus_data['text'], corpus_data['tfid'], corpus_data['token']
+  candidates = lsh_candidates(texts, cid) if lsh else None
+  passages = query_winnow(build_winnow(texts), texts[cid], exclude=cid % len(texts)) if winnow else None
+  return stream_chapter(ids, texts, tfid, token, cid, candidates, workers, corpus_data['exact'], passages=passages)
+
+def main_code(story_data,text_list,lsh=False,workers=None,verdict_only=False,telemetry=None,winnow=False,progress=None):
+  """
+  Main code of the system, checking the newly uploaded story checked against other stories in database.
+
+  Args:
+      story_data (pd.DataFrame): Data loaded from database.
+      text_list (array): list of cleaned text.
+      lsh (bool): only compare the candidate lines found by MinHash / LSH.
+      workers (int): number of worker processes, None for every core.
+      verdict_only (bool): only decide the upload verdict, stopping early, details is None.
+      telemetry (array): list filled with the prefilter counts of the check.
+      winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+      progress (function): called with (opp_fic_id, opp_chap_id, plag_score, matches, running max score) after every compared chapter, returning True cancels the check (None is returned).
+
+  Returns:
+      final (json): final similarity score and whether the file is safe to be uploaded or not.
+      details (json): lines with high similarity and the related works.
+  """
+  return check_corpus(prepare_corpus(story_data, text_list), [-1], lsh, workers, verdict_only, telemetry, winnow, progress)[0]
+
+def main_code_index(story_data, index_dir, lsh=False, workers=None, cache=preprocess_cache, verdict_only=False, telemetry=None, winnow=False, progress=None):
+  """
+  Main code of the system using the persistent corpus index, only chapters missing from the index are cleaned and vectorized.
+
+  Args:
+      story_data (pd.DataFrame): Data loaded from database.
+      index_dir (str): directory of the corpus index.
+      lsh (bool): only compare the candidate lines found by MinHash / LSH.
+      workers (int): number of worker processes, None for every core.
+      cache (dict): preprocessing cache.
+      verdict_only (bool): only decide the upload verdict, stopping early, details is None.
+      telemetry (array): list filled with the prefilter counts of the check.
+      winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+      progress (function): called with (opp_fic_id, opp_chap_id, plag_score, matches, running max score) after every compared chapter, returning True cancels the check (None is returned).
+
+  Returns:
+      final (json): final similarity score and whether the file is safe to be uploaded or not.
+      details (json): lines with high similarity and the related works.
+  """
+  return check_corpus(prepare_index(story_data, index_dir, workers, cache), [-1], lsh, workers, verdict_only, telemetry, winnow, progress)[0]
+
+def main_code_batch(story_data, new_chapters, index_dir=None, lsh=False, workers=None, cache=preprocess_cache, telemetry=None, winnow=False):
+  """
+  Checking many new chapters in one pass, against the database and against each other.
+
+  Args:
+      story_data (pd.DataFrame): Data loaded from database.
+      new_chapters (pd.DataFrame): new chapters with the same columns as story_data, rows already in story_data are replaced.
+      index_dir (str): directory of the persistent corpus index, None to refit on the whole database.
+      lsh (bool): only compare the candidate lines found by MinHash / LSH.
+      workers (int): number of worker processes, None for every core.
+      cache (dict): preprocessing cache.
+      telemetry (array): list filled with the prefilter counts of each new chapter.
+      winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+
+  Returns:
+      results (array): final and details json of each new chapter, in the order of new_chapters.
+  """
+  # New chapters go at the end of the corpus, like the single upload
+  new_ids = set(new_chapters.iloc[:,1:3].itertuples(index=False, name=None))
+  old = [key not in new_ids for key in story_data.iloc[:,1:3].itertuples(index=False, name=None)]
+  new_chapters = new_chapters.set_axis(story_data.columns, axis=1)
+  story_data = pd.concat([story_data[old], new_chapters], ignore_index=True)
+
+  if index_dir is None:
+    corpus_data = prepare_corpus(story_data, text_list(story_data, cache, workers))
+  else:
+    corpus_data = prepare_index(story_data, index_dir, workers, cache)
+  cids = list(range(len(story_data) - len(new_chapters), len(story_data)))
+  return check_corpus(corpus_data, cids, lsh, workers, telemetry=telemetry, winnow=winnow)
+
+def Plagiarism_Checker(data, index_dir=None, lsh=False, workers=None, cache_dir=None, verdict_only=False, winnow=False, progress=None, telemetry=None):
     """
     Function to call the main code and post result.
 
     Args:
         data (pd.DataFrame): data loaded from database.
+        index_dir (str): directory of the persistent corpus index, None to refit on the whole database.
+        lsh (bool): only compare the candidate lines found by MinHash / LSH.
+        workers (int): number of worker processes, None for every core.
+        cache_dir (str): directory of the on-disk preprocessing cache, None to only use the in-memory cache.
+        verdict_only (bool): only decide the upload verdict (upload gate), the details are posted empty.
+        winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+        progress (function): called after every compared chapter with its partial result, returning True cancels the check and nothing is posted.
+        telemetry (array): list filled with the prefilter counts (chapters, pruned, compared) of the check.
 
     Returns:
         show_arr (json): contain final and details json from main code.
     """
-    show_arr = main_code(data[0], text_list(data[0]))
-    response = requests.post(data[1], data=[show_arr])
+    cache = preprocess_cache if cache_dir is None else make_cache(cache_dir)
+    if index_dir is None:
+        show_arr = main_code(data[0], text_list(data[0], cache, workers), lsh, workers, verdict_only, telemetry, winnow, progress)
+    else:
+        show_arr = main_code_index(data[0], index_dir, lsh, workers, cache, verdict_only, telemetry, winnow, progress)
+    if show_arr is None:
+        return None
+    response = requests.post(data[1], data=[(show_arr[0], show_arr[1] or '')])
     if response.status_code == 200:
         print(response.json)
+
+    # The IDF refresh starts once the result is posted, in its own process
+    if index_dir is not None:
+        refresh_in_background(index_dir)
     return show_arr
 
-Plagiarism_Checker(request())
+def Plagiarism_Checker_Batch(data, new_chapters, index_dir=None, lsh=False, workers=None, cache_dir=None, winnow=False):
+    """
+    Function to check many new chapters in one corpus pass and post each result.
+
+    Args:
+        data (pd.DataFrame): data loaded from database.
+        new_chapters (pd.DataFrame): new chapters with the same columns as the database.
+        index_dir (str): directory of the persistent corpus index, None to refit on the whole database.
+        lsh (bool): only compare the candidate lines found by MinHash / LSH.
+        workers (int): number of worker processes, None for every core.
+        cache_dir (str): directory of the on-disk preprocessing cache, None to only use the in-memory cache.
+        winnow (bool): also flag the copied passages found by winnowing fingerprints (merged, split or reordered sentences).
+
+    Returns:
+        show_arrs (array): final and details json of each new chapter.
+    """
+    cache = preprocess_cache if cache_dir is None else make_cache(cache_dir)
+    show_arrs = main_code_batch(data[0], new_chapters, index_dir, lsh, workers, cache, winnow=winnow)
+    for show_arr in show_arrs:
+        response = requests.post(data[1], data=[show_arr])
+        if response.status_code == 200:
+            print(response.json)
+    if index_dir is not None:
+        refresh_in_background(index_dir)
+    return show_arrs
+
+if __name__ == "__main__":
+    Plagiarism_Checker(request())
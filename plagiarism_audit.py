@@ -0,0 +1,258 @@
+"""
+plagiarism_audit.py: Offline all-pairs near-duplicate job, auditing the whole library for chapters plagiarising each other.
+
+Args:
+    story_data (pd.DataFrame): data loaded from database (same columns as the JSON checker).
+    out_dir (str): directory of the checkpoints and of the ranked pairs.
+    chunk (int): number of chapters checked by one task.
+    workers (int): number of worker processes, None for every core.
+
+Returns:
+    pairs (array): suspicious chapter pairs of different fictions ranked by score, each direction scored like
+    final_plag_score (share of the lines of one chapter flagged against the other, in percent).
+
+The join is a blocked self-join: the chapters of a row block are joined with the column blocks from that row block
+on, so every pair i < j is visited once. The lines of each chapter are bounded against the chapter level data of
+the other block (block_prefilter, one sparse product per block pair), a pair is scored when either direction can reach the thresholds, and both
+directions come from one pass of line_matches (pair_scores). Every finished row block is written to out_dir/chunks
+as soon as it is done, a restarted job skips those blocks.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import Plagiarism_Checker_System_JSON_ver as checker
+from plagiarism_similarity import chapter_bounds, pair_scores, stack_chapters, block_prefilter
+
+# Read-only corpus of the audit workers, set once per worker by set_audit
+audit = {}
+
+def corpus_hash(corpus_data):
+    """
+    Creating the fingerprint of a corpus, checkpoints of another corpus are never resumed.
+
+    Args:
+        corpus_data (dict): corpus from prepare_corpus or prepare_index.
+
+    Returns:
+        digest (str): sha1 hex digest of the ids and cleaned texts.
+    """
+    digest = hashlib.sha1()
+    for (fic_id, chap_id), lines in zip(corpus_data['ids'], corpus_data['text']):
+        digest.update(json.dumps([str(fic_id), str(chap_id), lines]).encode('utf-8'))
+    return digest.hexdigest()
+
+def set_audit(*data):
+    """
+    Setting the read-only corpus, the chapter level bounds and the stacked blocks of an audit worker.
+
+    Args:
+        data (array): ids, text_list, tfid and token of every chapter, or the store form from corpus_args.
+    """
+    global audit
+    checker.set_corpus(*data)
+    _, _, tfid, token = checker.corpus
+    audit = {'data': checker.corpus, 'bounds': chapter_bounds(tfid, token), 'blocks': {}}
+
+def block_lines(start, stop):
+    """
+    Getting the stacked lines of one block of chapters, kept by the worker for the next row blocks.
+
+    Args:
+        start (int): position of the first chapter of the block.
+        stop (int): position after the last chapter of the block.
+
+    Returns:
+        block (dict): stacked lines from stack_chapters.
+    """
+    if start not in audit['blocks']:
+        _, _, tfid, token = audit['data']
+        audit['blocks'][start] = stack_chapters(tfid[start:stop], token[start:stop])
+    return audit['blocks'][start]
+
+def audit_chunk(chapters):
+    """
+    Scoring the chapters of one row block against the chapters of other fictions after them, in both directions.
+
+    Args:
+        chapters (array): positions of the chapters of the row block, consecutive.
+
+    Returns:
+        scores (array): (chapter, other chapter, plag_score) of every scored direction above 0.
+    """
+    ids, text_list, tfid, token = audit['data']
+    bounds = audit['bounds']
+    start, stop = chapters[0], chapters[-1] + 1
+    rows = {name: matrix[start:stop] for name, matrix in bounds.items()}
+    scores = []
+    for c0 in range(start, len(ids), len(chapters)):
+        c1 = min(c0 + len(chapters), len(ids))
+        columns = {name: matrix[c0:c1] for name, matrix in bounds.items()}
+
+        # A pair is scored when either direction can reach the thresholds, one sparse product per direction
+        forward = checker.unreachable_bounds(*block_prefilter(columns, block_lines(start, stop)))
+        backward = checker.unreachable_bounds(*block_prefilter(rows, block_lines(c0, c1)))
+        for a, b in zip(*np.nonzero(~forward | ~backward.T)):
+            i, j = start + int(a), c0 + int(b)
+            if j <= i or ids[i][0] == ids[j][0]:
+                continue
+            score_i, score_j = pair_scores(tfid[i], tfid[j], token[i], token[j])
+            if score_i:
+                scores.append((i, j, score_i))
+            if score_j:
+                scores.append((j, i, score_j))
+    return scores
+
+def save_chunk(out_dir, start, scores):
+    """
+    Writing the checkpoint of a finished chunk.
+
+    Args:
+        out_dir (str): directory of the job.
+        start (int): position of the first chapter of the chunk.
+        scores (array): scores of the chunk from audit_chunk.
+    """
+    # Written under a temporary name first, a killed job never leaves half a checkpoint
+    folder = os.path.join(out_dir, 'chunks')
+    tmp = os.path.join(folder, f'{start:08d}.{uuid.uuid4().hex}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump([[int(i), int(j), float(score)] for i, j, score in scores], f)
+    os.replace(tmp, os.path.join(folder, f'{start:08d}.json'))
+
+def load_chunks(out_dir):
+    """
+    Reading the checkpoints of the finished chunks.
+
+    Args:
+        out_dir (str): directory of the job.
+
+    Returns:
+        done (dict): first chapter of the chunk -> scores of the chunk.
+    """
+    folder = os.path.join(out_dir, 'chunks')
+    done = {}
+    for name in os.listdir(folder):
+        if name.endswith('.json'):
+            with open(os.path.join(folder, name), encoding='utf-8') as f:
+                done[int(name[:-5])] = [tuple(score) for score in json.load(f)]
+    return done
+
+def rank_pairs(ids, scores, min_score=0):
+    """
+    Merging both directions of every pair and ranking the pairs.
+
+    Args:
+        ids (array): fiction_id and chapter_id of every chapter.
+        scores (array): (chapter, other chapter, plag_score) of every scored direction.
+        min_score (float): pairs with a lower score (in percent) are left out.
+
+    Returns:
+        pairs (array): one dict per pair, highest score first.
+    """
+    merged = {}
+    for i, j, score in scores:
+        a, b = min(i, j), max(i, j)
+        merged.setdefault((a, b), [0.0, 0.0])[0 if i == a else 1] = score
+
+    pairs = []
+    for (a, b), (score_a, score_b) in merged.items():
+        score = round(max(score_a, score_b) * 100, 2)
+        if score < min_score:
+            continue
+        pairs.append({'fic_id_a': ids[a][0], 'chap_id_a': ids[a][1], 'fic_id_b': ids[b][0], 'chap_id_b': ids[b][1],
+                      'plag_score_a': round(score_a * 100, 2), 'plag_score_b': round(score_b * 100, 2),
+                      'final_plag_score': score, 'yes_or_no': int(max(score_a, score_b) >= checker.PLAG_THRESHOLD)})
+    pairs.sort(key=lambda pair: (-pair['final_plag_score'], -min(pair['plag_score_a'], pair['plag_score_b'])))
+    return pairs
+
+def audit_corpus(corpus_data, out_dir, chunk=64, workers=None, min_score=0):
+    """
+    Running the all-pairs job over a prepared corpus, resuming from the checkpoints of out_dir.
+
+    Args:
+        corpus_data (dict): corpus from prepare_corpus or prepare_index.
+        out_dir (str): directory of the checkpoints and of pairs.csv.
+        chunk (int): number of chapters checked by one task.
+        workers (int): number of worker processes, None for every core.
+        min_score (float): pairs with a lower score (in percent) are left out of the ranking.
+
+    Returns:
+        pairs (array): ranked suspicious pairs, also written to out_dir/pairs.csv.
+    """
+    ids = corpus_data['ids']
+    data = checker.corpus_args(corpus_data)
+    os.makedirs(os.path.join(out_dir, 'chunks'), exist_ok=True)
+
+    # Checkpoints only belong to the same corpus, chunking and join
+    manifest = {'corpus': corpus_hash(corpus_data), 'chunk': chunk, 'chapters': len(ids), 'join': 'self-join'}
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            if json.load(f) != manifest:
+                raise ValueError(f'{out_dir} holds checkpoints of another corpus, chunk size or join, use a new directory')
+    else:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+    done = load_chunks(out_dir)
+    todo = [start for start in range(0, len(ids), chunk) if start not in done]
+    tasks = [list(range(start, min(start + chunk, len(ids)))) for start in todo]
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(workers, initializer=set_audit, initargs=data) as pool:
+            # The first row blocks join the most column blocks, they start first and every block is saved as soon as it is done
+            futures = {pool.submit(audit_chunk, task): start for start, task in zip(todo, tasks)}
+            for future in as_completed(futures):
+                save_chunk(out_dir, futures[future], future.result())
+                done[futures[future]] = future.result()
+    else:
+        set_audit(*data)
+        for start, task in zip(todo, tasks):
+            done[start] = audit_chunk(task)
+            save_chunk(out_dir, start, done[start])
+
+    pairs = rank_pairs(ids, [score for start in sorted(done) for score in done[start]], min_score)
+    with open(os.path.join(out_dir, 'pairs.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['fic_id_a', 'chap_id_a', 'fic_id_b', 'chap_id_b', 'plag_score_a',
+                                               'plag_score_b', 'final_plag_score', 'yes_or_no'])
+        writer.writeheader()
+        writer.writerows(pairs)
+    return pairs
+
+def audit_library(story_data, out_dir, chunk=64, workers=None, min_score=0, index_dir=None, cache=None):
+    """
+    Cleaning and vectorizing the library, then running the all-pairs job.
+
+    Args:
+        story_data (pd.DataFrame): data loaded from database.
+        out_dir (str): directory of the checkpoints and of pairs.csv.
+        chunk (int): number of chapters checked by one task.
+        workers (int): number of worker processes, None for every core.
+        min_score (float): pairs with a lower score (in percent) are left out of the ranking.
+        index_dir (str): directory of the persistent corpus index, None to refit on the whole library.
+        cache (dict): preprocessing cache, default is the cache of the checker.
+
+    Returns:
+        pairs (array): ranked suspicious pairs, also written to out_dir/pairs.csv.
+    """
+    cache = checker.preprocess_cache if cache is None else cache
+    if index_dir is None:
+        corpus_data = checker.prepare_corpus(story_data, checker.text_list(story_data, cache, workers))
+    else:
+        corpus_data = checker.prepare_index(story_data, index_dir, workers, cache)
+    return audit_corpus(corpus_data, out_dir, chunk, workers, min_score)
+
+# Check: nightly audit of the library from the database
+if __name__ == "__main__":
+    import sys
+
+    pairs = audit_library(checker.request()[0], sys.argv[1] if len(sys.argv) > 1 else 'audit')
+    for pair in pairs[:20]:
+        print(pair)
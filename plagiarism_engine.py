@@ -0,0 +1,591 @@
+"""
+plagiarism_engine.py: One plagiarism engine for every source, loader plugins turn the JSON API, a CSV export or a
+folder of Word/PDF files into chapters, and the same cleaning, vectorizing and scoring path checks them.
+
+Args:
+    source (str): name of the loader plugin in SOURCES ('json', 'frame', 'csv', 'docx' or 'pdf').
+    location: url of the database, the DataFrame, path or url of the CSV file, or folder of the .docx/.pdf files.
+
+Returns:
+    scores (array): (chapter position, plag_score) of every chapter of the other fictions.
+
+Each source keeps the cleaning and the flag rule of its old checker, so it gives the same scores as before:
+the JSON API uses the JSON checker cleaning and json_flags, the CSV export and the Word/PDF files use the
+cleaning of their script/notebook and csv_flags. Vectorizing (vectorize_corpus) and the tiled line similarity
+(count_flag, line_matches) are shared by every source.
+"""
+
+import codecs
+import io
+import itertools
+import json
+import os
+import re
+
+import pandas as pd
+import requests
+
+import Plagiarism_Checker_System_JSON_ver as checker
+from plagiarism_index import load_index, build_index, add_chapter, exact_matches, refresh_in_background
+from plagiarism_preprocess import clean_texts
+from plagiarism_similarity import RULES, count_flag
+from plagiarism_store import Selection
+from plagiarism_tokenizer import sent_tokenize, word_tokenize, cleaner_namespace
+
+# Cleaning patterns of the CSV and Word/PDF checkers, compiled once
+REMOVED = re.compile(r'[“”‘’:;"_\',.()\–\[\]]')
+CSV_SPACES = re.compile(r'[\-]')
+DOCUMENT_SPACES = re.compile(r'[\-\/]')
+
+# Cache key of the cleaned CSV lines (with the punkt model, see cleaner_namespace), change it whenever remove_csv or get_list_csv changes
+CSV_CLEANER = 'csv-remove-v1'
+
+# Chapters asked for in one page of the paginated story database
+PAGE_SIZE = 500
+
+# Bytes of a page read at once, the rows are parsed as soon as they are complete
+CHUNK_SIZE = 1 << 20
+
+# Chapters cleaned together, only the raw stories of one batch are alive at a time
+INGEST_BATCH = 256
+
+# Start of the data array of a page
+DATA_ARRAY = re.compile(r'"data"\s*:\s*\[')
+SEPARATORS = re.compile(r'[\s,]*')
+
+# Lines of a document kept between these headings (the body of a paper), the whole document when missing
+BODY_START = 'latar belakang'
+BODY_END = ('daftar pustaka', 'reference')
+
+def remove_csv(text, spaces=CSV_SPACES):
+    """
+    Cleaning the unnecessary symbols inside a line, the same way as the CSV and Word/PDF checkers.
+
+    Args:
+        text (str): text to be cleaned.
+        spaces (re.Pattern): symbols replaced by a space, DOCUMENT_SPACES for the Word/PDF files.
+
+    Returns:
+        words (str): cleaned text.
+    """
+    sub_text = REMOVED.sub('', text)
+    sub_text = spaces.sub(' ', sub_text)
+    token_text = word_tokenize(sub_text)
+    words = [word for word in token_text if word]
+    return ' '.join(words)
+
+def get_list_csv(story):
+    """
+    Cleaning the text of one story of the CSV export line by line.
+
+    Args:
+        story (str): story text.
+
+    Returns:
+        list_arr (array): cleaned lines of the story.
+    """
+    return [remove_csv(text) for text in sent_tokenize(story.lower())]
+
+def document_lines(pages):
+    """
+    Cleaning a Word/PDF document page by page, only the cleaned lines are kept in memory.
+
+    Args:
+        pages (iterable): text of every paragraph (.docx) or page (.pdf), read lazily.
+
+    Returns:
+        lines (array): cleaned lines of the body of the document.
+    """
+    lines = []
+    for page in pages:
+        for sent in sent_tokenize(page.lower()):
+            lines.extend(line for line in (remove_csv(part, DOCUMENT_SPACES) for part in sent.split('\n')) if line)
+
+    # To define the first index and last index, may be removed depending on the format of text
+    first = lines.index(BODY_START) + 1 if BODY_START in lines else 0
+    last = next((lines.index(end) for end in BODY_END if end in lines), -1)
+    if first > 0 or last > 0:
+        return lines[first:last]
+    return lines
+
+def load_frame(story_data, story_column=-4):
+    """
+    Loading the chapters of a DataFrame with the columns of the database.
+
+    Args:
+        story_data (pd.DataFrame): data loaded from database.
+        story_column (int): position of the story column.
+
+    Returns:
+        chapters (generator): (fiction_id, chapter_id, story) of every row.
+    """
+    for row in story_data.itertuples(index=False, name=None):
+        yield row[1], row[2], row[story_column]
+
+def load_json(story_url='https://readscape.live/pdftodatabase'):
+    """
+    Loading the chapters of the story database API.
+
+    Args:
+        story_url (str): url of database.
+
+    Returns:
+        chapters (generator): (fiction_id, chapter_id, story) of every chapter.
+    """
+    return load_frame(checker.request(story_url)[0])
+
+def iter_rows(chunks):
+    """
+    Parsing the rows of a {"data": [...]} payload one at a time while it is downloaded.
+
+    Args:
+        chunks (iterable): bytes of the response body.
+
+    Returns:
+        rows (generator): every row of the data array, only the unparsed tail of the body is kept.
+    """
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    text = ''
+    inside = False
+    for chunk in chunks:
+        text += text_decoder.decode(chunk)
+        if not inside:
+            found = DATA_ARRAY.search(text)
+            if found is None:
+                continue
+            text, inside = text[found.end():], True
+
+        # Rows are decoded in place, the parsed head is dropped once per chunk
+        pos = 0
+        while True:
+            pos = SEPARATORS.match(text, pos).end()
+            if text.startswith(']', pos):
+                return
+            try:
+                row, pos_end = decoder.raw_decode(text, pos)
+            except ValueError:
+                # The row is not complete yet, wait for the next chunk
+                break
+            yield row
+            pos = pos_end
+        text = text[pos:]
+
+def row_chapter(row):
+    """
+    Getting the ids and the story of a database row, by position like the DataFrame of request.
+
+    Args:
+        row (dict): one row of the data array.
+
+    Returns:
+        chapter (tuple): (fiction_id, chapter_id, story).
+    """
+    values = list(row.values())
+    return values[1], values[2], values[-4]
+
+def load_pages(story_url='https://readscape.live/pdftodatabase', page_size=PAGE_SIZE):
+    """
+    Loading the chapters of the story database page by page (page and limit query parameters), each page is parsed
+    row by row while it is downloaded, so the raw payload of the library is never held at once.
+
+    Args:
+        story_url (str): url of database.
+        page_size (int): number of chapters asked for in one page.
+
+    Returns:
+        chapters (generator): (fiction_id, chapter_id, story) of every chapter.
+    """
+    seen = set()
+    for page in itertools.count(1):
+        with requests.get(story_url, params={'page': page, 'limit': page_size}, stream=True) as response:
+            response.raise_for_status()
+            count = 0
+            for row in iter_rows(response.iter_content(CHUNK_SIZE)):
+                chapter = row_chapter(row)
+                key = (str(chapter[0]), str(chapter[1]))
+                # A server without pagination gives the whole library again on every page
+                if count == 0 and key in seen:
+                    return
+                seen.add(key)
+                count += 1
+                yield chapter
+        if count != page_size:
+            return
+
+def load_csv(location):
+    """
+    Loading the chapters of a CSV export (columns of the Story Dataset, story second to last).
+
+    Args:
+        location (str): path or url of the CSV file, or the DataFrame already read from it.
+
+    Returns:
+        chapters (generator): (fiction_id, chapter_id, story) of every row.
+    """
+    if isinstance(location, pd.DataFrame):
+        return load_frame(location, -2)
+    if location.startswith(('http://', 'https://')):
+        location = io.StringIO(requests.get(location).content.decode('utf-8'))
+    return load_frame(pd.read_csv(location), -2)
+
+def document_files(folder, extension):
+    """
+    Listing the documents of a folder.
+
+    Args:
+        folder (str): folder of the documents.
+        extension (str): file extension, '.docx' or '.pdf'.
+
+    Returns:
+        files (array): file names ending with the extension, in directory order.
+    """
+    return [name for name in os.listdir(folder) if name.lower().endswith(extension)]
+
+def docx_pages(path):
+    """
+    Reading the paragraphs of a Word file one by one.
+
+    Args:
+        path (str): path of the .docx file.
+
+    Returns:
+        pages (generator): text of every paragraph.
+    """
+    import docx
+
+    for paragraph in docx.Document(path).paragraphs:
+        yield paragraph.text
+
+def pdf_pages(path):
+    """
+    Reading a PDF file one page at a time, the file stays open until the last page is read.
+
+    Args:
+        path (str): path of the .pdf file.
+
+    Returns:
+        pages (generator): extracted text of every page.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        from PyPDF2 import PdfReader
+
+    with open(path, 'rb') as f:
+        for page in PdfReader(f).pages:
+            yield page.extract_text()
+
+def load_docx(folder):
+    """
+    Loading every Word file of a folder, each file is its own fiction.
+
+    Args:
+        folder (str): folder of the .docx files.
+
+    Returns:
+        chapters (generator): (file name, 1, paragraphs) of every file.
+    """
+    for name in document_files(folder, '.docx'):
+        yield name, 1, docx_pages(os.path.join(folder, name))
+
+def load_pdf(folder):
+    """
+    Loading every PDF file of a folder, each file is its own fiction.
+
+    Args:
+        folder (str): folder of the .pdf files.
+
+    Returns:
+        chapters (generator): (file name, 1, pages) of every file.
+    """
+    for name in document_files(folder, '.pdf'):
+        yield name, 1, pdf_pages(os.path.join(folder, name))
+
+# Loader plugins: load gives the chapters, clean turns one chapter into cleaned lines (cached under cleaner
+# when it is a name, documents are streamed and never cached), rule is the flag rule of plagiarism_similarity
+SOURCES = {
+    'json': {'load': load_json, 'clean': checker.get_list, 'cleaner': checker.CLEANER, 'rule': 'json'},
+    'pages': {'load': load_pages, 'clean': checker.get_list, 'cleaner': checker.CLEANER, 'rule': 'json'},
+    'frame': {'load': load_frame, 'clean': checker.get_list, 'cleaner': checker.CLEANER, 'rule': 'json'},
+    'csv': {'load': load_csv, 'clean': get_list_csv, 'cleaner': CSV_CLEANER, 'rule': 'csv'},
+    'docx': {'load': load_docx, 'clean': document_lines, 'cleaner': None, 'rule': 'csv'},
+    'pdf': {'load': load_pdf, 'clean': document_lines, 'cleaner': None, 'rule': 'csv'},
+}
+
+def iter_source(source, location, cache=None, workers=1, **options):
+    """
+    Cleaning the chapters of a source while they are loaded, INGEST_BATCH stories at a time.
+
+    Args:
+        source (str): name of the loader plugin in SOURCES.
+        location: argument of the loader (url, DataFrame, path or folder).
+        cache (dict): preprocessing cache, default is the cache of the checker.
+        workers (int): number of worker processes for the stories missing from the cache, None for every core.
+        options: keyword arguments of the loader (page_size of the pages source).
+
+    Returns:
+        chapters (generator): (fiction_id, chapter_id, cleaned lines) of every chapter, in source order.
+    """
+    plugin = SOURCES[source]
+    cache = checker.preprocess_cache if cache is None else cache
+
+    def cleaned(batch):
+        lines = clean_texts([story for _, _, story in batch], plugin['clean'], cache, cleaner_namespace(plugin['cleaner']), workers)
+        return [(fic_id, chap_id, text) for (fic_id, chap_id, _), text in zip(batch, lines)]
+
+    batch = []
+    for fic_id, chap_id, content in plugin['load'](location, **options):
+        # Documents are cleaned while their pages are read, nothing else of them is kept
+        if not plugin['cleaner']:
+            yield fic_id, chap_id, plugin['clean'](content)
+            continue
+        batch.append((fic_id, chap_id, content))
+        if len(batch) >= INGEST_BATCH:
+            yield from cleaned(batch)
+            batch = []
+    yield from cleaned(batch)
+
+def load_source(source, location, cache=None, workers=1, **options):
+    """
+    Loading and cleaning the chapters of a source.
+
+    Args:
+        source (str): name of the loader plugin in SOURCES.
+        location: argument of the loader (url, DataFrame, path or folder).
+        cache (dict): preprocessing cache, default is the cache of the checker.
+        workers (int): number of worker processes for the stories missing from the cache, None for every core.
+        options: keyword arguments of the loader.
+
+    Returns:
+        ids (array): fiction_id and chapter_id of every chapter.
+        text_list (array): list of cleaned text.
+    """
+    ids, text_list = [], []
+    for fic_id, chap_id, lines in iter_source(source, location, cache, workers, **options):
+        ids.append((fic_id, chap_id))
+        text_list.append(lines)
+    return ids, text_list
+
+def ingest_index(source, location, index_dir, cache=None, workers=1, **options):
+    """
+    Streaming the chapters of a source into the persistent corpus index, chapters already indexed are only looked up.
+
+    Args:
+        source (str): name of the loader plugin in SOURCES.
+        location: argument of the loader (url, DataFrame, path or folder).
+        index_dir (str): directory of the corpus index, built from the source when it does not exist.
+        cache (dict): preprocessing cache, default is the cache of the checker.
+        workers (int): number of worker processes for cleaning, None for every core.
+        options: keyword arguments of the loader.
+
+    Returns:
+        corpus_data (dict): corpus in source order, in the form of prepare_index.
+    """
+    index = load_index(index_dir)
+    ids = []
+    if index is None:
+        # The first build fits the vocabulary, it needs the cleaned text of the whole library
+        text_list = []
+        for fic_id, chap_id, lines in iter_source(source, location, cache, workers, **options):
+            ids.append((fic_id, chap_id))
+            text_list.append(lines)
+        index = build_index(index_dir, [(str(fic_id), str(chap_id)) for fic_id, chap_id in ids], text_list)
+        del text_list
+        position = dict(index['positions'])
+    else:
+        position = dict(index['positions'])
+        for fic_id, chap_id, lines in iter_source(source, location, cache, workers, **options):
+            ids.append((fic_id, chap_id))
+            key = (str(fic_id), str(chap_id))
+            if key not in position:
+                position[key] = add_chapter(index, key[0], key[1], lines)
+
+    # The chapters currently in the source, in the same order as the source
+    order = [position[(str(fic_id), str(chap_id))] for fic_id, chap_id in ids]
+    return {'ids': ids, 'text': Selection(index['text'], order), 'tfid': Selection(index['tfid'], order),
+            'token': Selection(index['token'], order), 'exact': index['exact']}
+
+def check_pages(story_url='https://readscape.live/pdftodatabase', index_dir=None, page_size=PAGE_SIZE, cache=None, workers=None, verdict_only=False, winnow=False):
+    """
+    Checking the last chapter of the paginated story database, like main_code and main_code_index.
+
+    Args:
+        story_url (str): url of database.
+        index_dir (str): directory of the persistent corpus index, None to vectorize the streamed corpus.
+        page_size (int): number of chapters asked for in one page.
+        cache (dict): preprocessing cache, default is the cache of the checker.
+        workers (int): number of worker processes, None for every core.
+        verdict_only (bool): only decide the upload verdict, stopping early, details is None.
+        winnow (bool): also flag the copied passages found by winnowing fingerprints.
+
+    Returns:
+        final (json): final similarity score and whether the file is safe to be uploaded or not.
+        details (json): lines with high similarity and the related works.
+    """
+    if index_dir is None:
+        corpus_data = checker.vectorize_corpus(*load_source('pages', story_url, cache, workers, page_size=page_size))
+    else:
+        corpus_data = ingest_index('pages', story_url, index_dir, cache, workers, page_size=page_size)
+    show_arr = checker.check_corpus(corpus_data, [-1], workers=workers, verdict_only=verdict_only, winnow=winnow)[0]
+    if index_dir is not None:
+        refresh_in_background(index_dir)
+    return show_arr
+
+def score_chapter(corpus_data, cid=-1, rule='json', workers=1):
+    """
+    Scoring one chapter against every chapter of the other fictions.
+
+    Args:
+        corpus_data (dict): corpus from vectorize_corpus.
+        cid (int): position of the chapter being checked.
+        rule (str): flag rule in plagiarism_similarity.RULES.
+        workers (int): number of worker processes (json rule only), None for every core.
+
+    Returns:
+        scores (array): (chapter position, plag_score) of every chapter of the other fictions.
+    """
+    ids, texts, tfid, token = corpus_data['ids'], corpus_data['text'], corpus_data['tfid'], corpus_data['token']
+    cid = cid % len(ids)
+    others = [j for j in range(len(ids)) if ids[j][0] != ids[cid][0]]
+
+    # The json rule goes through the whole optimized check (prefilter, process pool)
+    if rule == 'json':
+        results = checker.chapter_results(ids, texts, tfid, token, cid, workers=workers, exact=corpus_data['exact'])
+        compared = set(others)
+        return [(j, score or 0.0) for j, score, _ in results if j in compared]
+
+    if not tfid[cid].shape[0]:
+        return [(j, 0.0) for j in others]
+    copies = exact_matches(corpus_data['exact'], texts[cid], {(str(fic_id), str(chap_id)): pos for pos, (fic_id, chap_id) in enumerate(ids)})
+    scores = []
+    for j in others:
+        plag_ft, di, hs, cp = count_flag(token[cid], token[j], tfid[cid], tfid[j], [], copies.get(j), RULES[rule])
+        scores.append((j, (plag_ft+(hs+cp)/2)/di))
+    return scores
+
+def check_source(source, location, cid=-1, cache=None, workers=1):
+    """
+    Checking one chapter of a source against the other fictions of the same source.
+
+    Args:
+        source (str): name of the loader plugin in SOURCES.
+        location: argument of the loader (url, DataFrame, path or folder).
+        cid (int): position of the chapter being checked, default is the last (the upload).
+        cache (dict): preprocessing cache, default is the cache of the checker.
+        workers (int): number of worker processes, None for every core.
+
+    Returns:
+        fin_plag_score (float): highest plag_score in percent.
+        scores (array): (fiction_id, chapter_id, plag_score) of every chapter of the other fictions.
+    """
+    ids, texts = load_source(source, location, cache, workers)
+    corpus_data = checker.vectorize_corpus(ids, texts)
+    scores = score_chapter(corpus_data, cid, SOURCES[source]['rule'], workers)
+    fin_plag_score = max((score for _, score in scores), default=0)
+    return fin_plag_score * 100, [(ids[j][0], ids[j][1], score) for j, score in scores]
+
+def pair_scores(source, location, cache=None):
+    """
+    Scoring every pair of chapters of different fictions in both directions, like the Word/PDF notebook.
+
+    Args:
+        source (str): name of the loader plugin in SOURCES.
+        location: argument of the loader (url, DataFrame, path or folder).
+        cache (dict): preprocessing cache, default is the cache of the checker.
+
+    Returns:
+        pairs (dict): (chapter position, other chapter position) -> plag_score of the first against the second.
+    """
+    ids, texts = load_source(source, location, cache)
+    corpus_data = checker.vectorize_corpus(ids, texts)
+    return {(cid, j): score for cid in range(len(ids)) for j, score in score_chapter(corpus_data, cid, SOURCES[source]['rule'])}
+
+# Check: python plagiarism_engine.py [baseline <git ref>]
+# Parity of the CSV and JSON sources with the scores of the old checkers saved in BASELINE_SCORES, and of the paged
+# source with main_code and main_code_index. 'baseline <git ref>' saves the scores of the old checkers again from the
+# scripts at that ref (run from a git checkout that has the ref, with the dependencies of the old scripts)
+if __name__ == "__main__":
+    import subprocess
+    import sys
+
+    from plagiarism_tokenizer import sentence_model
+
+    # Cleaned lines of the old checkers and their scores for every 10th chapter of the story dataset
+    BASELINE_SCORES = 'dataset/fanfiction/engine_baseline.json'
+
+    def old_script(ref, file, run):
+        # The old script without the run at its end
+        source = subprocess.run(['git', 'show', f'{ref}:{file}'], capture_output=True, text=True, check=True).stdout
+        namespace = {'__name__': 'baseline'}
+        exec(compile(source[:source.rindex(run)], f'{ref}:{file}', 'exec'), namespace)
+        return namespace
+
+    path = 'dataset/fanfiction/Story Dataset - Sheet1.csv'
+    frame = pd.read_csv(path)[['user_id', 'fiction_id', 'num_chapter', 'story', 'title_chapter', 'release_date_chapter', 'user_id']]
+    sources = [('csv', path), ('frame', frame)]
+
+    if sys.argv[1:2] == ['baseline']:
+        ref = sys.argv[2]
+        olds = {'csv': (old_script(ref, 'plagiarism_checker_system_csv_ver3.py', 'df, final, df_e = Plagiarism_Checker(request())'), pd.read_csv(path)),
+                'frame': (old_script(ref, 'Plagiarism_Checker_System_JSON_ver.py', 'Plagiarism_Checker(request())'), frame)}
+        baseline = {'ref': ref, 'punkt': sentence_model()}
+        for source, location in sources:
+            old, story_data = olds[source]
+            # The old text_list reads row[-2] / row[-4], a label lookup on pandas 3, so the columns are labelled by position from the end
+            old_texts = old['text_list'](story_data.set_axis(range(-story_data.shape[1], 0), axis=1))
+            flat_text = [line for text in old_texts for line in text]
+            old_tfid, old_token = old['vecTfid'](flat_text, old_texts), old['tokenizing'](flat_text, old_texts)
+
+            # The chapters compared with each chapter (the other fictions) are the ones the engine scores
+            ids, _ = load_source(source, location)
+            corpus_data = checker.vectorize_corpus(ids, old_texts)
+            scores = {}
+            for cid in range(0, len(ids), 10):
+                scores[str(cid)] = []
+                for j, _ in sorted(score_chapter(corpus_data, cid, SOURCES[source]['rule'])):
+                    # The csv checker names the other fiction, the JSON checker both fictions
+                    names = (ids[j][0],) if source == 'csv' else (ids[cid], ids[j])
+                    plag_ft, di, hs, cp = old['count_flag'](old_token[cid], old_token[j], old_tfid[cid], old_tfid[j], {}, old_texts[cid], old_texts[j], *names)
+                    scores[str(cid)].append([j, (plag_ft+(hs+cp)/2)/di])
+            baseline[source] = {'texts': old_texts, 'scores': scores}
+        with open(BASELINE_SCORES, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f)
+        print(f'saved the scores of the old checkers at {ref} to {BASELINE_SCORES}')
+        sys.exit()
+
+    with open(BASELINE_SCORES, encoding='utf-8') as f:
+        baseline = json.load(f)
+    for source, location in sources:
+        ids, texts = load_source(source, location)
+        # The cleaned lines depend on the punkt model that split them, they are only compared with the same model
+        if baseline['punkt'] == sentence_model():
+            assert texts == baseline[source]['texts']
+        else:
+            print(f'{source}: cleaning not compared, the baseline was split by another punkt model ({baseline["punkt"]})')
+        corpus_data = checker.vectorize_corpus(ids, baseline[source]['texts'])
+        worst = 0
+        for cid, expected in baseline[source]['scores'].items():
+            scores = sorted(score_chapter(corpus_data, int(cid), SOURCES[source]['rule']))
+            assert [j for j, _ in scores] == [j for j, _ in expected]
+            worst = max([worst] + [abs(score - old_score) for (_, score), (_, old_score) in zip(scores, expected)])
+        assert worst < 1e-9
+        print(f'{source}: {len(ids)} chapters, largest score difference with the {baseline["ref"]} checker {worst:.2e}')
+
+    # The paged source against main_code and main_code_index, served page by page by a stand-in of the database
+    import tempfile
+
+    from plagiarism_service import stand_in_database
+
+    frame = pd.read_csv(path)[['user_id', 'fiction_id', 'num_chapter', 'story', 'title_chapter', 'release_date_chapter', 'user_id']].iloc[:120]
+    frame.columns = ['user_id', 'fiction_id', 'chapter_id', 'story', 'title', 'date', 'author_id']
+    story_url, _, database = stand_in_database(json.loads(frame.to_json(orient='records')))
+    try:
+        expected = checker.main_code(frame, checker.text_list(frame), workers=1)
+        assert check_pages(story_url, page_size=25, workers=1) == expected
+        with tempfile.TemporaryDirectory() as tmp:
+            expected = checker.main_code_index(frame, os.path.join(tmp, 'direct'), workers=1)
+            assert check_pages(story_url, os.path.join(tmp, 'pages'), page_size=25, workers=1) == expected
+    finally:
+        database.shutdown()
+    print(f'pages: {len(frame)} chapters in pages of 25, same result as main_code and main_code_index')
@@ -0,0 +1,533 @@
+"""
+plagiarism_index.py: Persistent corpus index of the plagiarism checker, so an upload only vectorizes the new chapter.
+
+Args:
+    index_dir (str): directory of the index.
+    story_data (pd.DataFrame): story texts from database (fiction_id, chapter_id and story columns).
+    text_list (array): list of cleaned texts of every chapter.
+
+Returns:
+    index (dict): fitted vocabulary, IDF weights, per chapter tfidf vectors, token ids and lines, and the exact copy index.
+
+Layout of index_dir:
+    CURRENT: name of the active version directory.
+    <version>/meta.json: chapters the version was fitted on and chapters appended since (IDF refresh counter).
+    <version>/vocabulary.json: tfidf vocabulary (word -> column).
+    <version>/idf.npy: tfidf IDF weights.
+    <version>/words.jsonl: tokenizer words, the token id is the line number (append only).
+    <version>/chapters.jsonl: fiction_id, chapter_id and file of each chapter (append only).
+    <version>/chapters/*.npz: tfidf CSR arrays, token ids and cleaned lines of one chapter.
+    <version>/store/: memory-mapped store (plagiarism_store.py) of the chapters the version was built with and
+                      their exact copy index, loading maps it and reads its chapters when they are used, only later
+                      chapters come from their .npz.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from plagiarism_store import write_store, open_store, store_tfid, store_token, store_text, store_copies, StoreChapters
+from plagiarism_tokenizer import word_sequence, fit_word_index
+
+# Refit the IDF weights after this many chapters are appended
+REFRESH_EVERY = 500
+
+# Unfinished version directories (*.tmp) older than this are left over from a killed build and removed
+STALE_SECONDS = 3600
+
+lock = threading.RLock()
+
+class ExactIndex:
+    """
+    Exact copy index of an index version, cleaned line -> (fiction_id, chapter_id, line) of every chapter containing
+    it. The chapters of the store are found through its mapped line hashes, the chapters appended after the store
+    are kept in a dict (add_exact_lines).
+
+    Args:
+        store (dict): the opened store, None when every chapter is appended.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.added = {}
+
+    def get(self, line, default=None):
+        found = []
+        if self.store is not None:
+            found = [(*self.store['ids'][pos], line_no) for pos, line_no in store_copies(self.store, line)]
+        found += self.added.get(line, [])
+        return found or default
+
+    def setdefault(self, line, default=None):
+        return self.added.setdefault(line, default)
+
+def tokenize_lines(index, lines):
+    """
+    Tokenizing lines with the index vocabulary, unseen words are appended to the vocabulary.
+
+    Args:
+        index (dict): the loaded index.
+        lines (array): cleaned text lines.
+
+    Returns:
+        tokens (array): token ids of each line.
+        new_words (array): words added to the vocabulary.
+    """
+    word_index = index['word_index']
+    new_words = []
+    tokens = []
+    for line in lines:
+        ids = []
+        for word in word_sequence(line):
+            if word not in word_index:
+                word_index[word] = len(word_index) + 1
+                new_words.append(word)
+            ids.append(word_index[word])
+        tokens.append(ids)
+    return tokens, new_words
+
+def vectorize_lines(index, lines):
+    """
+    Vectorizing lines with the stored vocabulary and IDF weights (same values as TfidfVectorizer.transform).
+
+    Args:
+        index (dict): the loaded index.
+        lines (array): cleaned text lines.
+
+    Returns:
+        tfid (sparse.csr_matrix): L2 normalized tfidf rows.
+    """
+    counts = index['counter'].transform(lines)
+    return normalize(sparse.csr_matrix(counts.multiply(index['idf'])))
+
+def add_exact_lines(exact, key, lines):
+    """
+    Adding the lines of one chapter to the exact copy index.
+
+    Args:
+        exact (dict): cleaned line -> (fiction_id, chapter_id, line) of every chapter containing it.
+        key (array): fiction_id and chapter_id of the chapter.
+        lines (array): cleaned text lines of the chapter.
+    """
+    for line_no, line in enumerate(lines):
+        # Empty lines have no tfidf or token similarity, they are never copies
+        if line:
+            exact.setdefault(line, []).append((str(key[0]), str(key[1]), line_no))
+
+def build_exact_index(ids, text_list):
+    """
+    Creating the exact copy index of the corpus.
+
+    Args:
+        ids (array): (fiction_id, chapter_id) of each chapter.
+        text_list (array): list of cleaned texts of every chapter.
+
+    Returns:
+        exact (dict): cleaned line -> (fiction_id, chapter_id, line) of every chapter containing it.
+    """
+    exact = {}
+    for key, lines in zip(ids, text_list):
+        add_exact_lines(exact, key, lines)
+    return exact
+
+def exact_matches(exact, lines, position):
+    """
+    Finding the verbatim copies of the lines of the chapter being checked.
+
+    Args:
+        exact (dict): the exact copy index.
+        lines (array): cleaned text lines of the chapter being checked.
+        position (dict): (fiction_id, chapter_id) as str -> chapter position.
+
+    Returns:
+        matches (dict): chapter position -> {line being checked: lines of that chapter with the same text}.
+    """
+    matches = {}
+    for i, line in enumerate(lines):
+        for fic_id, chap_id, line_no in exact.get(line, []):
+            pos = position.get((fic_id, chap_id))
+            if pos is not None:
+                matches.setdefault(pos, {}).setdefault(i, []).append(line_no)
+    return matches
+
+def save_chapter(path, tfid, token, lines):
+    """
+    Saving the vectors, token ids and lines of one chapter.
+
+    Args:
+        path (str): path of the .npz file.
+        tfid (sparse.csr_matrix): tfidf rows of the chapter.
+        token (array): token ids of each line.
+        lines (array): cleaned text lines.
+    """
+    offsets = np.zeros(len(token) + 1, dtype=np.int64)
+    np.cumsum([len(line) for line in token], out=offsets[1:])
+    token_ids = np.array([tid for line in token for tid in line], dtype=np.int32)
+    np.savez(path, data=tfid.data, indices=tfid.indices, indptr=tfid.indptr, shape=np.array(tfid.shape),
+             token_ids=token_ids, token_offsets=offsets, lines=np.array(lines, dtype=str))
+
+def load_chapter(path):
+    """
+    Loading the vectors, token ids and lines of one chapter.
+
+    Args:
+        path (str): path of the .npz file.
+
+    Returns:
+        tfid (sparse.csr_matrix): tfidf rows of the chapter.
+        token (array): token ids of each line.
+        lines (array): cleaned text lines.
+    """
+    with np.load(path) as f:
+        tfid = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        token_ids = f['token_ids'].tolist()
+        offsets = f['token_offsets'].tolist()
+        lines = f['lines'].tolist()
+    token = [token_ids[offsets[i]:offsets[i + 1]] for i in range(len(lines))]
+    return tfid, token, lines
+
+def current_dir(index_dir):
+    """
+    Getting the directory of the active index version.
+
+    Args:
+        index_dir (str): directory of the index.
+
+    Returns:
+        path (str): directory of the active version, None if the index does not exist.
+    """
+    try:
+        with open(os.path.join(index_dir, 'CURRENT')) as f:
+            return os.path.join(index_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def write_version(index_dir, ids, text_list):
+    """
+    Fitting the vocabulary and IDF weights on the given chapters and writing them as a new version.
+
+    Args:
+        index_dir (str): directory of the index.
+        ids (array): (fiction_id, chapter_id) of each chapter.
+        text_list (array): list of cleaned texts of every chapter.
+
+    Returns:
+        version (str): name of the written version directory.
+    """
+    # Written into a temporary directory first, a killed build never leaves half a version
+    version = uuid.uuid4().hex
+    path = os.path.join(index_dir, version + '.tmp')
+    os.makedirs(os.path.join(path, 'chapters'))
+
+    # Fit the tfidf and tokenizer vocabulary on the whole corpus
+    flat_text = [line for text in text_list for line in text]
+    vec = TfidfVectorizer()
+    vec.fit(flat_text)
+    vocabulary = {word: int(col) for word, col in vec.vocabulary_.items()}
+    word_index = fit_word_index(flat_text)
+
+    with open(os.path.join(path, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocabulary, f)
+    np.save(os.path.join(path, 'idf.npy'), vec.idf_)
+    with open(os.path.join(path, 'words.jsonl'), 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(word) + '\n' for word in word_index)
+
+    # Transform every chapter once, later uploads only transform themselves
+    index = {'path': path, 'counter': CountVectorizer(vocabulary=vocabulary), 'idf': vec.idf_, 'word_index': word_index}
+    tfids, tokens = [], []
+    with open(os.path.join(path, 'chapters.jsonl'), 'w', encoding='utf-8') as manifest:
+        for (fic_id, chap_id), lines in zip(ids, text_list):
+            file = uuid.uuid4().hex + '.npz'
+            token, _ = tokenize_lines(index, lines)
+            tfid = vectorize_lines(index, lines)
+            save_chapter(os.path.join(path, 'chapters', file), tfid, token, lines)
+            manifest.write(json.dumps({'fiction_id': str(fic_id), 'chapter_id': str(chap_id), 'file': file}) + '\n')
+            tfids.append(tfid)
+            tokens.append(token)
+
+    # The same chapters once more as one memory-mapped store, loading maps it instead of reading every .npz
+    write_store(os.path.join(path, 'store'), ids, tfids, tokens, text_list)
+    write_meta(path, {'chapters': len(tfids), 'added': 0})
+    os.replace(path, os.path.join(index_dir, version))
+    return version
+
+def write_meta(path, meta):
+    """
+    Writing the metadata of a version.
+
+    Args:
+        path (str): directory of the version.
+        meta (dict): chapters the version was fitted on and chapters appended since.
+    """
+    tmp = os.path.join(path, f'meta.{uuid.uuid4().hex}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+def remove_stale_versions(index_dir, keep):
+    """
+    Removing the versions that are no longer active and the unfinished builds left by killed processes.
+
+    Args:
+        index_dir (str): directory of the index.
+        keep (array): names of the versions kept (the active one and the previous one, still read by processes
+            that loaded it before the switch).
+    """
+    now = time.time()
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name in keep or not os.path.isdir(path):
+            continue
+        if name.endswith('.tmp') and now - os.path.getmtime(path) < STALE_SECONDS:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+def set_current(index_dir, version):
+    """
+    Switching the active index version.
+
+    Args:
+        index_dir (str): directory of the index.
+        version (str): name of the version directory.
+    """
+    tmp = os.path.join(index_dir, 'CURRENT.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(index_dir, 'CURRENT'))
+
+def build_index(index_dir, ids, text_list):
+    """
+    Building the index from the whole corpus.
+
+    Args:
+        index_dir (str): directory of the index.
+        ids (array): (fiction_id, chapter_id) of each chapter.
+        text_list (array): list of cleaned texts of every chapter.
+
+    Returns:
+        index (dict): the loaded index.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with lock:
+        set_current(index_dir, write_version(index_dir, ids, text_list))
+    return load_index(index_dir)
+
+def load_index(index_dir, version=None):
+    """
+    Loading a version of the index.
+
+    Args:
+        index_dir (str): directory of the index.
+        version (str): name of the version directory, default is the active version.
+
+    Returns:
+        index (dict): the loaded index, None if the index does not exist.
+    """
+    path = os.path.join(index_dir, version) if version else current_dir(index_dir)
+    if path is None:
+        return None
+
+    with open(os.path.join(path, 'vocabulary.json'), encoding='utf-8') as f:
+        vocabulary = json.load(f)
+    with open(os.path.join(path, 'words.jsonl'), encoding='utf-8') as f:
+        word_index = {json.loads(word): i for i, word in enumerate(f, start=1)}
+
+    # Versions written before the store existed are read from the .npz files only
+    store = open_store(os.path.join(path, 'store'))
+    index = {'dir': index_dir, 'path': path, 'counter': CountVectorizer(vocabulary=vocabulary),
+             'idf': np.load(os.path.join(path, 'idf.npy')), 'word_index': word_index,
+             'ids': list(store['ids']) if store is not None else [], 'tfid': StoreChapters(store, store_tfid),
+             'token': StoreChapters(store, store_token), 'text': StoreChapters(store, store_text, cache=False),
+             'exact': ExactIndex(store), 'store': store}
+    index['positions'] = dict(zip(index['ids'], range(len(index['ids']))))
+
+    # Chapters appended after the store are read from their .npz
+    with open(os.path.join(path, 'chapters.jsonl'), encoding='utf-8') as f:
+        rows = f.readlines()[len(index['ids']):]
+    for row in rows:
+        row = json.loads(row)
+        tfid, token, lines = load_chapter(os.path.join(path, 'chapters', row['file']))
+        append_chapter(index, (row['fiction_id'], row['chapter_id']), tfid, token, lines)
+
+    # Versions written before meta.json count the chapters after the store as appended
+    try:
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            index['meta'] = json.load(f)
+    except FileNotFoundError:
+        fitted = store['chapters'] if store is not None else len(index['ids'])
+        index['meta'] = {'chapters': fitted, 'added': len(index['ids']) - fitted}
+    return index
+
+def add_chapter(index, fic_id, chap_id, lines, follow=True):
+    """
+    Appending a new chapter to the index, only this chapter is vectorized and tokenized.
+
+    The number of appended chapters is kept in the version metadata, refresh_if_due refits the IDF weights once
+    it reaches REFRESH_EVERY.
+
+    Args:
+        index (dict): the loaded index.
+        fic_id (str): fiction ID of the chapter.
+        chap_id (str): chapter ID of the chapter.
+        lines (array): cleaned text lines of the chapter.
+        follow (bool): reload the index first when another process switched to a refreshed version.
+
+    Returns:
+        position (int): position of the chapter in the index.
+    """
+    key = (str(fic_id), str(chap_id))
+    with lock:
+        # Follow a refresh that finished since the index was loaded
+        if follow and current_dir(index['dir']) != index['path']:
+            index.update(load_index(index['dir']))
+        if key in index['positions']:
+            return index['positions'][key]
+
+        tfid = vectorize_lines(index, lines)
+        token, new_words = tokenize_lines(index, lines)
+
+        file = uuid.uuid4().hex + '.npz'
+        save_chapter(os.path.join(index['path'], 'chapters', file), tfid, token, lines)
+        with open(os.path.join(index['path'], 'words.jsonl'), 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(word) + '\n' for word in new_words)
+        with open(os.path.join(index['path'], 'chapters.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'fiction_id': key[0], 'chapter_id': key[1], 'file': file}) + '\n')
+        index['meta']['added'] += 1
+        write_meta(index['path'], index['meta'])
+
+    return append_chapter(index, key, tfid, token, list(lines))
+
+def append_chapter(index, key, tfid, token, lines):
+    """
+    Appending a chapter to the loaded index in memory.
+
+    Args:
+        index (dict): the loaded index.
+        key (array): fiction_id and chapter_id of the chapter.
+        tfid (sparse.csr_matrix): tfidf rows of the chapter.
+        token (array): token ids of each line.
+        lines (array): cleaned text lines.
+
+    Returns:
+        position (int): position of the chapter in the index.
+    """
+    index['positions'][key] = len(index['ids'])
+    index['ids'].append(key)
+    index['tfid'].append(tfid)
+    index['token'].append(token)
+    index['text'].append(lines)
+    add_exact_lines(index['exact'], key, lines)
+    return len(index['ids']) - 1
+
+def refresh_due(index, refresh_every=REFRESH_EVERY):
+    """
+    Telling whether enough chapters were appended to the index to refit the IDF weights.
+
+    Args:
+        index (dict): the loaded index.
+        refresh_every (int): number of appended chapters starting a refresh, None to never refresh.
+
+    Returns:
+        due (bool): a refresh should run.
+    """
+    return bool(refresh_every) and index['meta']['added'] >= refresh_every
+
+def refresh_if_due(index_dir, refresh_every=REFRESH_EVERY):
+    """
+    Refitting the IDF weights when enough chapters were appended, the refresh runs in the calling thread and is
+    finished when this returns (the scheduled refresh job and the process started by refresh_in_background).
+    Only one process refreshes at a time, the others return None while REFRESH.lock exists.
+
+    Args:
+        index_dir (str): directory of the index.
+        refresh_every (int): number of appended chapters starting a refresh, None to never refresh.
+
+    Returns:
+        version (str): name of the new active version, None when no refresh was due or another one is running.
+    """
+    index = load_index(index_dir)
+    if index is None or not refresh_due(index, refresh_every):
+        return None
+
+    # A lock left by a killed refresh is taken over once it is stale
+    lock_path = os.path.join(index_dir, 'REFRESH.lock')
+    try:
+        if time.time() - os.path.getmtime(lock_path) >= STALE_SECONDS:
+            os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return None
+    try:
+        return refresh_index(index_dir)
+    finally:
+        os.remove(lock_path)
+
+def refresh_in_background(index_dir, refresh_every=REFRESH_EVERY):
+    """
+    Starting the IDF refresh in a separate process when it is due, so the check that reached REFRESH_EVERY does not
+    wait for it (the checkers call it after posting their result). The process runs refresh_if_due and goes on after
+    the checker exits.
+
+    Args:
+        index_dir (str): directory of the index.
+        refresh_every (int): number of appended chapters starting a refresh, None to never refresh.
+
+    Returns:
+        process (subprocess.Popen): the refresh process, None when no refresh was due.
+    """
+    index = load_index(index_dir)
+    if index is None or not refresh_due(index, refresh_every):
+        return None
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), 'refresh', index_dir, f'--if-due={refresh_every}'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def refresh_index(index_dir):
+    """
+    Refitting the vocabulary and IDF weights on every indexed chapter into a new version.
+
+    Chapters appended while the new version is being built are copied into it before it becomes active. The
+    previous version is kept for the processes still reading it, older versions are removed.
+
+    Args:
+        index_dir (str): directory of the index.
+
+    Returns:
+        version (str): name of the new active version.
+    """
+    old = load_index(index_dir)
+    version = write_version(index_dir, old['ids'], old['text'])
+
+    with lock:
+        # Catch up with the chapters appended during the rebuild, then switch
+        new = load_index(index_dir, version)
+        with open(os.path.join(old['path'], 'chapters.jsonl'), encoding='utf-8') as f:
+            rows = [json.loads(row) for row in f][len(old['ids']):]
+        for row in rows:
+            _, _, lines = load_chapter(os.path.join(old['path'], 'chapters', row['file']))
+            add_chapter(new, row['fiction_id'], row['chapter_id'], lines, follow=False)
+        set_current(index_dir, version)
+    remove_stale_versions(index_dir, (version, os.path.basename(old['path'])))
+    return version
+
+# Check: python plagiarism_index.py refresh <index_dir> [--if-due[=<chapters>]] (scheduled IDF refresh job)
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ['refresh'] and len(args) > 1:
+        due = [arg for arg in args if arg.startswith('--if-due')]
+        if due:
+            print(refresh_if_due(args[1], int(due[0].split('=')[1]) if '=' in due[0] else REFRESH_EVERY))
+        else:
+            print(refresh_index(args[1]))
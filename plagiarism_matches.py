@@ -0,0 +1,157 @@
+"""
+plagiarism_matches.py: Columnar accumulator of the matched lines, serialized straight to the details json.
+
+Args:
+    text (array): cleaned lines of the chapter being checked.
+    ids (array): fiction_id and chapter_id of every chapter.
+    text_list (array): list of cleaned texts of every chapter.
+
+Returns:
+    details (str): the same json as the exploded DataFrame of add_values (ori_fic_id, ori_chap_id, ori_line,
+    opp_fic_id, opp_chap_id and sim_line columns, rows numbered from 0), written without building the DataFrame.
+
+Matches are kept as parallel integer arrays (line of the checked chapter, chapter position, line of that chapter).
+Checked lines with the same text share one key and matched lines with the same text are only kept once per
+chapter, like the nested dictionary of add_values, with a set instead of scanning the lists.
+"""
+
+import json
+from array import array
+
+import numpy as np
+
+def make_matches(text):
+    """
+    Creating an empty match accumulator.
+
+    Args:
+        text (array): cleaned lines of the chapter being checked.
+
+    Returns:
+        matches (dict): the match accumulator.
+    """
+    return {'text': text, 'key': {}, 'line': array('q'), 'chapter': array('q'), 'opp_line': array('q'), 'seen': set()}
+
+def add_matches(matches, line, chapter, opp_lines, opp_text):
+    """
+    Adding the matched lines of one line of the checked chapter.
+
+    Args:
+        matches (dict): the match accumulator.
+        line (int): line of the chapter being checked.
+        chapter (int): position of the other chapter.
+        opp_lines (array): lines of the other chapter matching the line.
+        opp_text (array): cleaned lines of the other chapter.
+    """
+    # Lines with the same text are one key, like the text keys of add_values
+    key = matches['key'].setdefault(matches['text'][line], line)
+    seen = matches['seen']
+    for k in opp_lines:
+        pair = (key, chapter, opp_text[k])
+        if pair not in seen:
+            seen.add(pair)
+            matches['line'].append(key)
+            matches['chapter'].append(chapter)
+            matches['opp_line'].append(int(k))
+
+def match_groups(matches, ids):
+    """
+    Ordering the matches like the nested dictionary: checked line, then fiction and chapter of the other story.
+
+    Args:
+        matches (dict): the match accumulator.
+        ids (array): fiction_id and chapter_id of every chapter.
+
+    Returns:
+        order (np.ndarray): row order of the matches.
+        groups (np.ndarray): start of each (line, opp_fic_id, opp_chap_id) group inside order.
+    """
+    if not len(matches['line']):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    line = np.frombuffer(matches['line'], dtype=np.int64)
+
+    # Rank of each level by first appearance, dictionary keys keep their insertion order
+    def first_seen(*columns):
+        rank = {}
+        return np.array([rank.setdefault(key, len(rank)) for key in zip(*columns)], dtype=np.int64)
+
+    fic = [ids[j][0] for j in matches['chapter']]
+    chap = [ids[j][1] for j in matches['chapter']]
+    line_rank = first_seen(line.tolist())
+    fic_rank = first_seen(line.tolist(), fic)
+    chap_rank = first_seen(line.tolist(), fic, chap)
+
+    order = np.lexsort((np.arange(len(line)), chap_rank, fic_rank, line_rank))
+    groups = np.flatnonzero(np.diff(chap_rank[order], prepend=-1) != 0)
+    return order, groups
+
+def json_value(value):
+    """
+    Encoding one value the same way as DataFrame.to_json.
+
+    Args:
+        value (object): id or text line.
+
+    Returns:
+        encoded (str): json of the value.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    return json.dumps(value).replace('/', '\\/')
+
+def iter_details(matches, ids, text_list, cid=-1):
+    """
+    Writing the details json column by column.
+
+    Args:
+        matches (dict): the match accumulator.
+        ids (array): fiction_id and chapter_id of every chapter.
+        text_list (array): list of cleaned texts of every chapter.
+        cid (int): position of the chapter being checked.
+
+    Returns:
+        chunks (generator): pieces of the details json.
+    """
+    order, _ = match_groups(matches, ids)
+    line = [matches['line'][r] for r in order]
+    chapter = [matches['chapter'][r] for r in order]
+    opp_line = [matches['opp_line'][r] for r in order]
+    text = matches['text']
+    ori_fic_id, ori_chap_id = json_value(ids[cid][0]), json_value(ids[cid][1])
+
+    if not len(order):
+        # No similar line at all, one placeholder row
+        columns = [('ori_fic_id', [ori_fic_id]), ('ori_chap_id', [ori_chap_id])]
+        columns += [(name, ['"-"']) for name in ('ori_line', 'opp_fic_id', 'opp_chap_id', 'sim_line')]
+        columns = [(name, iter(values)) for name, values in columns]
+    else:
+        columns = [('ori_fic_id', (ori_fic_id for _ in order)),
+                   ('ori_chap_id', (ori_chap_id for _ in order)),
+                   ('ori_line', (json_value(text[i]) for i in line)),
+                   ('opp_fic_id', (json_value(ids[j][0]) for j in chapter)),
+                   ('opp_chap_id', (json_value(ids[j][1]) for j in chapter)),
+                   ('sim_line', (json_value(text_list[j][k]) for j, k in zip(chapter, opp_line)))]
+
+    yield '{'
+    for c, (name, values) in enumerate(columns):
+        yield (',' if c else '') + f'"{name}":{{'
+        for r, value in enumerate(values):
+            yield f'{"," if r else ""}"{r}":{value}'
+        yield '}'
+    yield '}'
+
+def opp_fic_ids(matches, ids):
+    """
+    Getting the fiction of the other story for every (line, opp_fic_id, opp_chap_id) group, as in the final json.
+
+    Args:
+        matches (dict): the match accumulator.
+        ids (array): fiction_id and chapter_id of every chapter.
+
+    Returns:
+        opp_fic_id (array): fiction_id of each group, ['-'] when nothing matched.
+    """
+    order, groups = match_groups(matches, ids)
+    if not len(groups):
+        return ['-']
+    return [ids[matches['chapter'][order[g]]][0] for g in groups]
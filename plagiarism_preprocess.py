@@ -0,0 +1,143 @@
+"""
+plagiarism_preprocess.py: Cached and batched cleaning of the story texts for the plagiarism checker.
+
+Args:
+    stories (array): story text of every chapter.
+    clean (function): cleaner turning one story into its cleaned lines.
+    cache (dict): preprocessing cache from make_cache.
+
+Returns:
+    lists (array): list of cleaned texts, unchanged stories are taken from the cache without any NLTK work.
+
+The cache key is a hash of the cleaner name and the story text, so an edited chapter or a changed cleaner
+is cleaned again. The checkers put the punkt model in the cleaner name (cleaner_namespace), lines split by another
+sentence model are never reused. Cached lines live in an in-memory LRU and, when cache_dir is given, one JSON file per story.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Batches with fewer misses are cleaned serially, the process pool overhead would dominate
+PARALLEL_MIN_STORIES = 32
+
+def make_cache(cache_dir=None, size=4096):
+    """
+    Creating the preprocessing cache.
+
+    Args:
+        cache_dir (str): directory of the on-disk store, None to only keep the in-memory LRU.
+        size (int): number of stories kept in memory.
+
+    Returns:
+        cache (dict): the preprocessing cache.
+    """
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    return {'dir': cache_dir, 'size': size, 'memory': OrderedDict()}
+
+def story_key(story, namespace):
+    """
+    Creating the cache key of a story.
+
+    Args:
+        story (str): story text.
+        namespace (str): name and version of the cleaner.
+
+    Returns:
+        key (str): sha1 hex digest of the cleaner and the story.
+    """
+    return hashlib.sha1(f'{namespace}\0{story}'.encode('utf-8')).hexdigest()
+
+def cache_get(cache, key):
+    """
+    Getting the cleaned lines of a story from the cache.
+
+    Args:
+        cache (dict): the preprocessing cache.
+        key (str): cache key of the story.
+
+    Returns:
+        lines (array): cleaned lines, None if the story is not cached.
+    """
+    memory = cache['memory']
+    if key in memory:
+        memory.move_to_end(key)
+        return memory[key]
+    if cache['dir'] is None:
+        return None
+
+    try:
+        with open(os.path.join(cache['dir'], key[:2], key + '.json'), encoding='utf-8') as f:
+            lines = json.load(f)
+    except FileNotFoundError:
+        return None
+    cache_put(cache, key, lines, disk=False)
+    return lines
+
+def cache_put(cache, key, lines, disk=True):
+    """
+    Putting the cleaned lines of a story into the cache.
+
+    Args:
+        cache (dict): the preprocessing cache.
+        key (str): cache key of the story.
+        lines (array): cleaned lines.
+        disk (bool): also write the lines to the on-disk store.
+    """
+    memory = cache['memory']
+    memory[key] = lines
+    memory.move_to_end(key)
+    while len(memory) > cache['size']:
+        memory.popitem(last=False)
+
+    if disk and cache['dir'] is not None:
+        # Written under a temporary name first, so readers never see half a file
+        folder = os.path.join(cache['dir'], key[:2])
+        os.makedirs(folder, exist_ok=True)
+        tmp = os.path.join(folder, f'{key}.{uuid.uuid4().hex}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(lines, f)
+        os.replace(tmp, os.path.join(folder, key + '.json'))
+
+def clean_texts(stories, clean, cache=None, namespace='', workers=1):
+    """
+    Cleaning every story, only the stories missing from the cache are cleaned.
+
+    Args:
+        stories (array): story text of every chapter.
+        clean (function): cleaner turning one story into its cleaned lines (module level, so workers can use it).
+        cache (dict): preprocessing cache, None to clean everything.
+        namespace (str): name and version of the cleaner, part of the cache key.
+        workers (int): number of worker processes for the cache misses, None for every core.
+
+    Returns:
+        lists (array): list of cleaned texts.
+    """
+    lists = [None] * len(stories)
+    keys = [story_key(story, namespace) for story in stories] if cache is not None else []
+    for pos, key in enumerate(keys):
+        lists[pos] = cache_get(cache, key)
+
+    # Clean each distinct missing story once
+    missing = OrderedDict()
+    for pos, story in enumerate(stories):
+        if lists[pos] is None:
+            missing.setdefault(story, []).append(pos)
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(missing) >= PARALLEL_MIN_STORIES:
+        with ProcessPoolExecutor(workers) as pool:
+            cleaned = list(pool.map(clean, missing, chunksize=max(1, len(missing) // (workers * 4))))
+    else:
+        cleaned = [clean(story) for story in missing]
+
+    for (story, positions), lines in zip(missing.items(), cleaned):
+        for pos in positions:
+            lists[pos] = lines
+        if cache is not None:
+            cache_put(cache, keys[positions[0]], lines)
+    return lists
@@ -0,0 +1,553 @@
+"""
+plagiarism_service.py: Resident plagiarism check service, the corpus index and fitted vectorizers stay warm in memory.
+
+Args:
+    index_dir (str): directory of the persistent corpus index.
+    story_url (str): url of the story database (pdftodatabase), loaded once at startup.
+    result_url (str): url the results are posted to, default is story_url like Plagiarism_Checker.
+
+Returns:
+    HTTP (asyncio, standard library only):
+        GET  /health        chapters in the corpus, queued and running checks.
+        POST /chapters      {"data": [rows]} adds new chapters to the warm corpus.
+        POST /check         {"data": [rows], "verdict_only": false, "winnow": false, "lsh": false} adds the rows and
+                            queues one check per row, answers 202 with the job ids (503 when the queue is full).
+        GET  /jobs/<id>     status of a job, final and details json once it is done.
+
+Rows have the same columns as the pdftodatabase data. Checks run in a thread pool of `concurrency` threads and
+every result is posted to result_url in the background, in the same form as Plagiarism_Checker. New chapters are
+added by one ingest thread, which also keeps the chapter bounds, document vectors and LSH / winnow indexes of the
+corpus up to date, so a check only reads them.
+"""
+
+import asyncio
+import json
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import requests
+from scipy import sparse
+
+import Plagiarism_Checker_System_JSON_ver as checker
+from plagiarism_index import load_index, build_index, add_chapter, lock, refresh_due, refresh_index
+from plagiarism_lsh import build_lsh, add_lsh
+from plagiarism_similarity import chapter_bounds, add_bounds, document_vectors
+from plagiarism_winnow import build_winnow, add_winnow
+
+# Finished jobs kept for GET /jobs, the oldest are forgotten first
+JOBS_KEPT = 1024
+
+class Prefix:
+    """
+    Read-only view of the first chapters of an append-only corpus list, a snapshot without copying the list.
+
+    Args:
+        items (list): the corpus list, only appended to.
+        length (int): number of chapters in the snapshot.
+    """
+
+    def __init__(self, items, length):
+        self.items = items
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.items[k] for k in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('chapter position out of range')
+        return self.items[i]
+
+    def __iter__(self):
+        return (self.items[k] for k in range(self.length))
+
+def make_service(index_dir, story_url=None, result_url=None, concurrency=2, queue_size=64, cache=None):
+    """
+    Creating the service state.
+
+    Args:
+        index_dir (str): directory of the persistent corpus index.
+        story_url (str): url of the story database, None to start from the index only.
+        result_url (str): url the results are posted to, default is story_url, None to keep them local.
+        concurrency (int): number of checks running at the same time.
+        queue_size (int): number of checks waiting at most, later checks are refused.
+        cache (dict): preprocessing cache, default is the cache of the checker.
+
+    Returns:
+        service (dict): the service state.
+    """
+    return {'index_dir': index_dir, 'story_url': story_url, 'result_url': result_url or story_url,
+            'concurrency': concurrency, 'queue_size': queue_size,
+            'cache': checker.preprocess_cache if cache is None else cache,
+            'index': None, 'ids': {}, 'corpus': None, 'jobs': OrderedDict(), 'running': 0, 'queue': None,
+            'indexes': set(), 'refresh': None, 'executor': ThreadPoolExecutor(concurrency), 'ingest': ThreadPoolExecutor(1)}
+
+def warm_corpus(service):
+    """
+    Building the chapter level data of the whole index, when the service starts or after the index was reloaded.
+
+    Args:
+        service (dict): the service state.
+
+    Returns:
+        corpus (dict): list references, names, chapter bounds, document vectors and indexes of the first `length` chapters.
+    """
+    index = service['index']
+    with lock:
+        corpus = {name: index[name] for name in ('ids', 'text', 'tfid', 'token', 'exact', 'positions', 'path')}
+        length = len(index['ids'])
+    tfid, token, text = Prefix(corpus['tfid'], length), Prefix(corpus['token'], length), Prefix(corpus['text'], length)
+    corpus.update({'length': length, 'names': [service['ids'].get(key, key) for key in Prefix(corpus['ids'], length)],
+                   'bounds': chapter_bounds(tfid, token), 'documents': document_vectors(tfid),
+                   'lsh': build_lsh(text) if 'lsh' in service['indexes'] else None,
+                   'winnow': build_winnow(text) if 'winnow' in service['indexes'] else None})
+    return corpus
+
+def extend_corpus(service, corpus):
+    """
+    Appending the chapters added to the index since the corpus data was built, only their rows are computed.
+
+    Args:
+        service (dict): the service state.
+        corpus (dict): corpus data from warm_corpus, it is not changed.
+
+    Returns:
+        corpus (dict): corpus data covering every chapter of the index.
+    """
+    start = corpus['length']
+    with lock:
+        length = len(corpus['ids'])
+    if length == start:
+        return corpus
+    keys = corpus['ids'][start:length]
+    tfid, token, text = corpus['tfid'][start:length], corpus['token'][start:length], corpus['text'][start:length]
+    extended = dict(corpus, length=length, names=corpus['names'] + [service['ids'].get(key, key) for key in keys],
+                    bounds=add_bounds(corpus['bounds'], tfid, token),
+                    documents=sparse.vstack([corpus['documents'], document_vectors(tfid)], format='csr'))
+    if extended['lsh'] is not None:
+        extended['lsh'] = add_lsh(extended['lsh'], text, start)
+    if extended['winnow'] is not None:
+        extended['winnow'] = add_winnow(extended['winnow'], text, start)
+    return extended
+
+def add_rows(service, story_data, indexes=()):
+    """
+    Adding chapters to the warm corpus, only the chapters missing from the index are cleaned and vectorized
+    (runs in the ingest thread, the only one changing the corpus).
+
+    Args:
+        service (dict): the service state.
+        story_data (pd.DataFrame): rows of the story database.
+        indexes (array): line indexes the checks of these rows need ('lsh', 'winnow'), built once and kept up to date.
+
+    Returns:
+        keys (array): index key of every row.
+    """
+    ids = list(story_data.iloc[:,1:3].itertuples(index=False, name=None))
+    keys = [(str(fic_id), str(chap_id)) for fic_id, chap_id in ids]
+
+    if service['index'] is None:
+        service['index'] = load_index(service['index_dir'])
+    if service['index'] is None:
+        service['index'] = build_index(service['index_dir'], keys, checker.text_list(story_data, service['cache'], 1))
+
+    # Original ids, so the json shows them as the database gave them
+    service['ids'].update(zip(keys, ids))
+    index = service['index']
+    with lock:
+        known = set(index['positions'])
+    new = [pos for pos, key in enumerate(keys) if key not in known]
+    for pos, lines in zip(new, checker.text_list(story_data.iloc[new], service['cache'], 1)):
+        # add_chapter fills the lists after writing the chapter, snapshots must not see half of it
+        with lock:
+            add_chapter(index, keys[pos][0], keys[pos][1], lines)
+
+    # Another process may have refreshed the index, add_chapter then reloaded it with new vectors
+    corpus = service['corpus']
+    if corpus is None or corpus['path'] != index['path']:
+        corpus = warm_corpus(service)
+    else:
+        corpus = extend_corpus(service, corpus)
+        for key in keys:
+            pos = corpus['positions'].get(key)
+            if pos is not None and pos < len(corpus['names']):
+                corpus['names'][pos] = service['ids'][key]
+
+    # The first check asking for a line index builds it over the whole corpus
+    missing = [name for name in indexes if name not in service['indexes']]
+    if missing:
+        service['indexes'].update(missing)
+        text = Prefix(corpus['text'], corpus['length'])
+        corpus = dict(corpus, lsh=build_lsh(text) if 'lsh' in missing else corpus['lsh'],
+                      winnow=build_winnow(text) if 'winnow' in missing else corpus['winnow'])
+    with lock:
+        service['corpus'] = corpus
+    return keys
+
+def refresh_corpus(service):
+    """
+    Refitting the IDF weights of the index once enough chapters were appended, then rebuilding the warm corpus
+    (runs in the ingest thread, checks keep reading the previous corpus until it is replaced).
+
+    Args:
+        service (dict): the service state.
+    """
+    if not refresh_due(service['index']):
+        return
+    refresh_index(service['index_dir'])
+    service['index'] = load_index(service['index_dir'])
+    corpus = warm_corpus(service)
+    with lock:
+        service['corpus'] = corpus
+
+def corpus_snapshot(service):
+    """
+    Taking a consistent view of the corpus, chapters added later do not change a running check. The lists are
+    only appended to, so the view keeps their length instead of copying them.
+
+    Args:
+        service (dict): the service state.
+
+    Returns:
+        corpus_data (dict): corpus in the form of prepare_corpus, with its bounds, document vectors and indexes.
+    """
+    with lock:
+        corpus = service['corpus']
+    length = corpus['length']
+    return {'ids': Prefix(corpus['names'], length), 'text': Prefix(corpus['text'], length),
+            'tfid': Prefix(corpus['tfid'], length), 'token': Prefix(corpus['token'], length),
+            'exact': corpus['exact'], 'positions': corpus['positions'], 'bounds': corpus['bounds'],
+            'documents': corpus['documents'], 'lsh': corpus['lsh'], 'winnow': corpus['winnow']}
+
+def run_check(service, key, options):
+    """
+    Checking one chapter of the warm corpus (runs in the thread pool).
+
+    Args:
+        service (dict): the service state.
+        key (array): index key of the chapter.
+        options (dict): verdict_only, winnow and lsh flags of the request.
+
+    Returns:
+        show_arr (array): final and details json.
+    """
+    corpus_data = corpus_snapshot(service)
+    cid = corpus_data['positions'][key]
+    return checker.check_corpus(corpus_data, [cid], bool(options.get('lsh')), 1, bool(options.get('verdict_only')),
+                                winnow=bool(options.get('winnow')))[0]
+
+def post_result(url, show_arr):
+    """
+    Posting a result to the database, in the same form as Plagiarism_Checker.
+
+    Args:
+        url (str): url the results are posted to.
+        show_arr (array): final and details json.
+
+    Returns:
+        status (int): HTTP status of the post.
+    """
+    response = requests.post(url, data=[(show_arr[0], show_arr[1] or '')])
+    return response.status_code
+
+def stand_in_database(rows, host='127.0.0.1', port=0):
+    """
+    Starting a stand-in of the story database in a thread, for checks without readscape.live.
+
+    GET /pdftodatabase answers {"data": rows}, one page of rows when the page and limit query parameters are
+    given. Every POST is answered 200 and its form fields are kept.
+
+    Args:
+        rows (array): rows of the story database.
+        host (str): address to listen on.
+        port (int): port to listen on, 0 for any free port.
+
+    Returns:
+        url (str): url of the pdftodatabase stand-in.
+        posts (array): form fields of every POST, in the order they came.
+        server (ThreadingHTTPServer): the running server, server.shutdown() stops it.
+    """
+    posts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            if 'page' in query:
+                limit = int(query['limit'][0])
+                start = (int(query['page'][0]) - 1) * limit
+                self.reply({'data': rows[start:start + limit]})
+            else:
+                self.reply({'data': rows})
+
+        def do_POST(self):
+            form = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+            posts.append(parse_qs(form, keep_blank_values=True))
+            self.reply({'status': 'ok'})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://{host}:{server.server_address[1]}/pdftodatabase', posts, server
+
+def forget_jobs(service):
+    """
+    Dropping the oldest finished jobs above JOBS_KEPT.
+
+    Args:
+        service (dict): the service state.
+    """
+    jobs = service['jobs']
+    for job_id in [job_id for job_id, job in jobs.items() if job['status'] in ('done', 'failed')][:max(len(jobs) - JOBS_KEPT, 0)]:
+        del jobs[job_id]
+
+async def job_worker(service):
+    """
+    Running the queued checks one after another, service['concurrency'] of these run side by side.
+
+    Args:
+        service (dict): the service state.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        job_id = await service['queue'].get()
+        job = service['jobs'][job_id]
+        job['status'] = 'running'
+        service['running'] += 1
+        try:
+            show_arr = await loop.run_in_executor(service['executor'], run_check, service, job['key'], job['options'])
+            job.update({'status': 'done', 'final': show_arr[0], 'details': show_arr[1]})
+        except Exception as error:
+            job.update({'status': 'failed', 'error': repr(error)})
+        finally:
+            service['running'] -= 1
+            service['queue'].task_done()
+
+        url = job['options'].get('result_url') or service['result_url']
+        if job['status'] == 'done' and url:
+            try:
+                job['posted'] = await loop.run_in_executor(None, post_result, url, (job['final'], job['details']))
+            except requests.RequestException as error:
+                job['posted'] = repr(error)
+        forget_jobs(service)
+
+async def add_chapters_async(service, rows, indexes=()):
+    """
+    Adding rows to the corpus in the ingest thread without blocking the event loop, a due IDF refresh is queued
+    behind them in the same thread.
+
+    Args:
+        service (dict): the service state.
+        rows (array): rows of the story database.
+        indexes (array): line indexes the checks of these rows need.
+
+    Returns:
+        keys (array): index key of every row.
+    """
+    loop = asyncio.get_running_loop()
+    keys = await loop.run_in_executor(service['ingest'], add_rows, service, pd.DataFrame(rows), indexes)
+    if refresh_due(service['index']) and (service['refresh'] is None or service['refresh'].done()):
+        service['refresh'] = loop.run_in_executor(service['ingest'], refresh_corpus, service)
+    return keys
+
+async def route(service, method, path, body):
+    """
+    Answering one request.
+
+    Args:
+        service (dict): the service state.
+        method (str): HTTP method.
+        path (str): request path.
+        body (dict): json body of the request.
+
+    Returns:
+        status (int): HTTP status.
+        payload (dict): json answer.
+    """
+    if method == 'GET' and path == '/health':
+        index = service['index']
+        return 200, {'chapters': len(index['ids']) if index else 0, 'queued': service['queue'].qsize(), 'running': service['running']}
+
+    if method == 'GET' and path.startswith('/jobs/'):
+        job = service['jobs'].get(path[len('/jobs/'):])
+        if job is None:
+            return 404, {'error': 'unknown job'}
+        return 200, {name: value for name, value in job.items() if name not in ('key', 'options')}
+
+    if method == 'POST' and path in ('/chapters', '/check'):
+        rows = body.get('data') or []
+        if not rows:
+            return 400, {'error': 'no rows in data'}
+        if path == '/check' and service['queue'].qsize() + len(rows) > service['queue_size']:
+            return 503, {'error': 'queue is full'}
+        options = {name: body.get(name) for name in ('verdict_only', 'winnow', 'lsh', 'result_url')}
+        keys = await add_chapters_async(service, rows, [name for name in ('lsh', 'winnow') if options[name]])
+        if path == '/chapters':
+            return 200, {'added': len(keys)}
+
+        # Other checks were queued while the rows were added, the room is reserved now that nothing awaits until
+        # every job is queued, so put_nowait cannot fail half way (the chapters stay in the corpus)
+        if service['queue'].qsize() + len(keys) > service['queue_size']:
+            return 503, {'error': 'queue is full'}
+        job_ids = []
+        for key in keys:
+            job_id = uuid.uuid4().hex
+            service['jobs'][job_id] = {'status': 'queued', 'key': key, 'options': options,
+                                       'fiction_id': key[0], 'chapter_id': key[1]}
+            service['queue'].put_nowait(job_id)
+            job_ids.append(job_id)
+        return 202, {'jobs': job_ids}
+
+    return 404, {'error': 'not found'}
+
+async def handle(service, reader, writer):
+    """
+    Reading one HTTP request from the connection and writing the json answer.
+
+    Args:
+        service (dict): the service state.
+        reader (asyncio.StreamReader): connection input.
+        writer (asyncio.StreamWriter): connection output.
+    """
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        raw = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        if len(request_line) < 2:
+            status, payload = 400, {'error': 'bad request'}
+        else:
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                status, payload = 400, {'error': 'body is not json'}
+            else:
+                status, payload = await route(service, request_line[0], request_line[1].split('?')[0], body)
+    except Exception as error:
+        status, payload = 500, {'error': repr(error)}
+
+    data = json.dumps(payload).encode('utf-8')
+    reason = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+    writer.write(f'HTTP/1.1 {status} {reason.get(status, "")}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + data)
+    await writer.drain()
+    writer.close()
+
+async def start_service(service, host='127.0.0.1', port=8080):
+    """
+    Loading the corpus, starting the check workers and the HTTP server.
+
+    Args:
+        service (dict): the service state.
+        host (str): address to listen on.
+        port (int): port to listen on, 0 for any free port.
+
+    Returns:
+        server (asyncio.Server): the running server (server.sockets[0].getsockname() gives the port).
+    """
+    loop = asyncio.get_running_loop()
+    if service['story_url']:
+        story_data = (await loop.run_in_executor(None, checker.request, service['story_url']))[0]
+        await loop.run_in_executor(service['ingest'], add_rows, service, story_data)
+    else:
+        if service['index'] is None:
+            service['index'] = load_index(service['index_dir'])
+        if service['index'] is not None and service['corpus'] is None:
+            service['corpus'] = await loop.run_in_executor(service['ingest'], warm_corpus, service)
+
+    service['queue'] = asyncio.Queue(service['queue_size'])
+    service['workers'] = [asyncio.create_task(job_worker(service)) for _ in range(service['concurrency'])]
+    return await asyncio.start_server(lambda reader, writer: handle(service, reader, writer), host, port)
+
+async def serve(service, host='127.0.0.1', port=8080):
+    """
+    Running the service until it is stopped.
+
+    Args:
+        service (dict): the service state.
+        host (str): address to listen on.
+        port (int): port to listen on.
+    """
+    server = await start_service(service, host, port)
+    async with server:
+        await server.serve_forever()
+
+async def check_service(rows, upload, index_dir):
+    """
+    Running one /check end to end against the stand-in story database.
+
+    Args:
+        rows (array): rows of the stand-in story database.
+        upload (array): row of the chapter being checked.
+        index_dir (str): directory of the corpus index, created by the service.
+
+    Returns:
+        job (dict): finished job from GET /jobs/<id>.
+        posts (array): results the service posted to the stand-in.
+    """
+    story_url, posts, database = stand_in_database(rows)
+    service = make_service(index_dir, story_url)
+    server = await start_service(service, port=0)
+    url = f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+    loop = asyncio.get_running_loop()
+    try:
+        response = await loop.run_in_executor(None, lambda: requests.post(url + '/check', json={'data': [upload]}))
+        assert response.status_code == 202, response.text
+        [job_id] = response.json()['jobs']
+        while True:
+            job = (await loop.run_in_executor(None, requests.get, f'{url}/jobs/{job_id}')).json()
+            if job['status'] == 'failed' or 'posted' in job:
+                return job, posts
+            await asyncio.sleep(0.05)
+    finally:
+        server.close()
+        database.shutdown()
+
+# Check: python plagiarism_service.py check [chapters] (one /check end to end against a stand-in story database,
+# the result must be the one main_code_index gives on the same rows)
+# Run:   python plagiarism_service.py <index_dir> [story_url] [port]
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ['check']:
+        import tempfile
+
+        n = int(args[1]) if len(args) > 1 else 40
+        story = pd.read_csv('dataset/fanfiction/Story Dataset - Sheet1.csv')
+        # Columns of the pdftodatabase rows, the story text is 4th from the end
+        rows = story[['user_id', 'fiction_id', 'num_chapter', 'story', 'title_chapter', 'release_date_chapter', 'user_id']].iloc[:n].values.tolist()
+        upload = [rows[0][0], 'upload', 1] + rows[0][3:]
+        with tempfile.TemporaryDirectory() as tmp:
+            job, posts = asyncio.run(check_service(rows, upload, tmp + '/service'))
+            assert job['status'] == 'done', job
+            assert job['posted'] == 200 and posts == [{job['final']: [job['details']]}], posts
+            final, details = checker.main_code_index(pd.DataFrame(rows + [upload]), tmp + '/direct', workers=1)
+        assert (job['final'], job['details']) == (final, details)
+        print(f"check of the upload over {n} chapters: {json.loads(final)['final_plag_score']}%, same result as main_code_index")
+    else:
+        service = make_service(args[0] if args else 'plagiarism_index', args[1] if len(args) > 1 else 'https://readscape.live/pdftodatabase')
+        asyncio.run(serve(service, '0.0.0.0', int(args[2]) if len(args) > 2 else 8080))
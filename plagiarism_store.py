@@ -0,0 +1,311 @@
+"""
+plagiarism_store.py: Memory-mapped on-disk store of the corpus vectors, worker processes open it with numpy.memmap
+and share its pages through the OS cache instead of each holding a copy of the corpus.
+
+Args:
+    store_dir (str): directory of the store.
+    ids (array): (fiction_id, chapter_id) of each chapter.
+    tfid (array): L2 normalized tfidf rows of every chapter (same vocabulary).
+    token (array): token ids of every line of every chapter.
+    text_list (array): list of cleaned texts of every chapter.
+
+Returns:
+    store (dict): memory-mapped arrays of the store, chapters are read back as views without copying.
+
+Layout of store_dir:
+    meta.json: number of chapters, lines and tfidf columns.
+    ids.json: fiction_id and chapter_id of each chapter (the id table).
+    chapter_lines.npy: first line of each chapter (chapters + 1 offsets).
+    tfid_data.npy, tfid_indices.npy, tfid_indptr.npy: CSR arrays of the tfidf rows of every line.
+    token_ids.npy, token_offsets.npy: int32 token ids of every line and the first id of each line.
+    text.npy, text_offsets.npy: utf-8 bytes of every cleaned line and the first byte of each line.
+    line_hashes.npy, hash_lines.npy: sorted 64-bit hashes of the non-empty lines and the line of each hash (the exact
+                                     copy index, a line is found with a binary search instead of a dict of the corpus).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from scipy import sparse
+
+# Arrays of the store, each one is a .npy file opened with mmap_mode='r'
+ARRAYS = ('chapter_lines', 'tfid_data', 'tfid_indices', 'tfid_indptr', 'token_ids', 'token_offsets', 'text', 'text_offsets')
+
+# Arrays of the exact copy index, missing from stores written before it (their lines are hashed when loaded)
+HASH_ARRAYS = ('line_hashes', 'hash_lines')
+
+class StoreChapters:
+    """
+    Chapters of a store read on first access, followed by the chapters appended after the store was written.
+    Nothing is read when the list is created, so loading an index does not walk the corpus.
+
+    Args:
+        store (dict): the opened store, None when every chapter is appended.
+        read (function): store_tfid, store_token or store_text.
+        cache (bool): keep every chapter once read (views of the mapped arrays), False decodes it on every read.
+    """
+
+    def __init__(self, store, read, cache=True):
+        self.store = store
+        self.read = read
+        self.cache = {} if cache else None
+        self.stored = store['chapters'] if store is not None else 0
+        self.appended = []
+
+    def __len__(self):
+        return self.stored + len(self.appended)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('chapter position out of range')
+        if i >= self.stored:
+            return self.appended[i - self.stored]
+        if self.cache is None:
+            return self.read(self.store, i)
+        if i not in self.cache:
+            self.cache[i] = self.read(self.store, i)
+        return self.cache[i]
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+    def append(self, chapter):
+        self.appended.append(chapter)
+
+class Selection:
+    """
+    Read-only view of some chapters of a corpus list in another order, chapters are only read when accessed.
+
+    Args:
+        items (list): the corpus list.
+        positions (array): position in items of every chapter of the view.
+    """
+
+    def __init__(self, items, positions):
+        self.items = items
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.items[p] for p in self.positions[i]]
+        return self.items[self.positions[i]]
+
+    def __iter__(self):
+        return (self.items[p] for p in self.positions)
+
+def line_hash(line):
+    """
+    Hashing a cleaned line for the exact copy index, the same value in every process.
+
+    Args:
+        line (bytes): utf-8 bytes of the line.
+
+    Returns:
+        hash (int): unsigned 64-bit hash.
+    """
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'little')
+
+def hash_index(encoded):
+    """
+    Creating the exact copy index arrays of the lines.
+
+    Args:
+        encoded (array): utf-8 bytes of every line of the store.
+
+    Returns:
+        line_hashes (np.ndarray): sorted hashes of the non-empty lines.
+        hash_lines (np.ndarray): line of each hash (lines with the same hash in line order).
+    """
+    # Empty lines have no tfidf or token similarity, they are never copies
+    lines = np.array([k for k, line in enumerate(encoded) if line], dtype=np.int64)
+    hashes = np.fromiter((line_hash(encoded[k]) for k in lines), dtype=np.uint64, count=len(lines))
+    order = np.argsort(hashes, kind='stable')
+    return hashes[order], lines[order]
+
+def offsets(lengths):
+    """
+    Creating the offsets of consecutive pieces.
+
+    Args:
+        lengths (array): length of every piece.
+
+    Returns:
+        offsets (np.ndarray): start of every piece and the total length (len(lengths) + 1 values).
+    """
+    result = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=result[1:])
+    return result
+
+def write_store(store_dir, ids, tfid, token, text_list):
+    """
+    Writing the store, it only appears under store_dir once every array is written.
+
+    Args:
+        store_dir (str): directory of the store, replaced when it exists.
+        ids (array): (fiction_id, chapter_id) of each chapter.
+        tfid (array): L2 normalized tfidf rows of every chapter.
+        token (array): token ids of every line of every chapter.
+        text_list (array): list of cleaned texts of every chapter.
+    """
+    n_cols = max((tf.shape[1] for tf in tfid), default=0)
+    rows = sparse.vstack(tfid, format='csr') if tfid else sparse.csr_matrix((0, n_cols))
+    rows.sort_indices()
+    lines = [line for text in token for line in text]
+    encoded = [line.encode('utf-8') for text in text_list for line in text]
+
+    # int32 CSR indices as long as they fit, so scipy takes the arrays without converting them
+    index_dtype = np.int32 if rows.nnz < 2**31 and n_cols < 2**31 else np.int64
+    arrays = {
+        'chapter_lines': offsets([tf.shape[0] for tf in tfid]),
+        'tfid_data': rows.data.astype(np.float64),
+        'tfid_indices': rows.indices.astype(index_dtype),
+        'tfid_indptr': rows.indptr.astype(index_dtype),
+        'token_ids': np.fromiter((tid for line in lines for tid in line), dtype=np.int32, count=sum(len(line) for line in lines)),
+        'token_offsets': offsets([len(line) for line in lines]),
+        'text': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'text_offsets': offsets([len(line) for line in encoded]),
+    }
+    arrays['line_hashes'], arrays['hash_lines'] = hash_index(encoded)
+
+    # Written into a temporary directory first, readers never see half a store
+    tmp = f'{store_dir}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    with open(os.path.join(tmp, 'ids.json'), 'w', encoding='utf-8') as f:
+        json.dump([[str(fic_id), str(chap_id)] for fic_id, chap_id in ids], f)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'chapters': len(tfid), 'lines': len(lines), 'n_cols': n_cols}, f)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp, store_dir)
+
+def open_store(store_dir):
+    """
+    Opening the store, the arrays are memory-mapped read-only and nothing is decoded. Stores written before the
+    exact copy index get it from their lines here.
+
+    Args:
+        store_dir (str): directory of the store.
+
+    Returns:
+        store (dict): the store, None if it does not exist.
+    """
+    try:
+        with open(os.path.join(store_dir, 'meta.json'), encoding='utf-8') as f:
+            store = json.load(f)
+    except FileNotFoundError:
+        return None
+    with open(os.path.join(store_dir, 'ids.json'), encoding='utf-8') as f:
+        store['ids'] = [tuple(key) for key in json.load(f)]
+    store['dir'] = store_dir
+    for name in ARRAYS:
+        store[name] = np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r')
+    if os.path.exists(os.path.join(store_dir, HASH_ARRAYS[0] + '.npy')):
+        for name in HASH_ARRAYS:
+            store[name] = np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r')
+    else:
+        bounds = store['text_offsets'].tolist()
+        data = store['text'].tobytes()
+        store['line_hashes'], store['hash_lines'] = hash_index([data[bounds[k]:bounds[k + 1]] for k in range(store['lines'])])
+    return store
+
+def store_tfid(store, j):
+    """
+    Getting the tfidf rows of one chapter, the data and indices are views of the mapped arrays.
+
+    Args:
+        store (dict): the opened store.
+        j (int): position of the chapter.
+
+    Returns:
+        tfid (sparse.csr_matrix): L2 normalized tfidf rows of the chapter.
+    """
+    first, last = int(store['chapter_lines'][j]), int(store['chapter_lines'][j + 1])
+    indptr = np.asarray(store['tfid_indptr'][first:last + 1])
+    start, end = int(indptr[0]), int(indptr[-1])
+    return sparse.csr_matrix((store['tfid_data'][start:end], store['tfid_indices'][start:end], indptr - start),
+                             shape=(last - first, store['n_cols']), copy=False)
+
+def store_token(store, j):
+    """
+    Getting the token ids of one chapter, every line is a view of the mapped token ids.
+
+    Args:
+        store (dict): the opened store.
+        j (int): position of the chapter.
+
+    Returns:
+        token (array): int32 token ids of each line.
+    """
+    first, last = int(store['chapter_lines'][j]), int(store['chapter_lines'][j + 1])
+    bounds = store['token_offsets'][first:last + 1].tolist()
+    token_ids = store['token_ids']
+    return [token_ids[bounds[i]:bounds[i + 1]] for i in range(last - first)]
+
+def store_text(store, j):
+    """
+    Getting the cleaned lines of one chapter.
+
+    Args:
+        store (dict): the opened store.
+        j (int): position of the chapter.
+
+    Returns:
+        lines (array): cleaned text lines of the chapter.
+    """
+    first, last = int(store['chapter_lines'][j]), int(store['chapter_lines'][j + 1])
+    bounds = store['text_offsets'][first:last + 1].tolist()
+    data = store['text'][bounds[0]:bounds[-1]].tobytes()
+    return [data[bounds[i] - bounds[0]:bounds[i + 1] - bounds[0]].decode('utf-8') for i in range(last - first)]
+
+def store_vectors(store, positions=None):
+    """
+    Getting the tfidf rows and token ids of several chapters as views of the mapped arrays.
+
+    Args:
+        store (dict): the opened store.
+        positions (array): positions of the chapters, default is every chapter.
+
+    Returns:
+        tfid (array): tfidf rows of each chapter.
+        token (array): token ids of each chapter.
+    """
+    positions = range(store['chapters']) if positions is None else positions
+    return [store_tfid(store, j) for j in positions], [store_token(store, j) for j in positions]
+
+def store_copies(store, line):
+    """
+    Finding the lines of the store with the same text as a line, with a binary search of the line hashes.
+
+    Args:
+        store (dict): the opened store.
+        line (str): cleaned text line.
+
+    Returns:
+        copies (array): (chapter position, line) of every copy, in store order.
+    """
+    encoded = line.encode('utf-8')
+    if not encoded:
+        return []
+    value = np.uint64(line_hash(encoded))
+    lo = int(np.searchsorted(store['line_hashes'], value, side='left'))
+    hi = int(np.searchsorted(store['line_hashes'], value, side='right'))
+    copies = []
+    for k in store['hash_lines'][lo:hi].tolist():
+        # Lines of another text with the same hash are skipped
+        if store['text'][store['text_offsets'][k]:store['text_offsets'][k + 1]].tobytes() == encoded:
+            chapter = int(np.searchsorted(store['chapter_lines'], k, side='right')) - 1
+            copies.append((chapter, k - int(store['chapter_lines'][chapter])))
+    return copies
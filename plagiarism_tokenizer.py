@@ -0,0 +1,250 @@
+"""
+plagiarism_tokenizer.py: Lightweight tokenizers of the plagiarism checker, without TensorFlow and without downloading at import.
+
+Args:
+    texts (array): cleaned text lines.
+
+Returns:
+    Tokenizer: same word_index and sequences as tensorflow.keras.preprocessing.text.Tokenizer (fit_on_texts, texts_to_sequences).
+    sent_tokenize / word_tokenize: NLTK tokenizers, NLTK and the punkt model are only loaded on the first call.
+
+The punkt model is searched in the bundled nltk_data directory next to this file, then in the NLTK_DATA directories
+and the usual NLTK paths. A missing model raises LookupError, the sentence splits (and so every plag_score) depend
+on it, so it is never replaced by an untrained tokenizer. Nothing is downloaded unless DOWNLOAD is set. To bundle
+the model next to this file:
+    python -c "import nltk; nltk.download('punkt_tab', download_dir='nltk_data')"
+"""
+
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+
+# Same filters as the Keras Tokenizer
+FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+TRANSLATE = str.maketrans({c: ' ' for c in FILTERS})
+
+NLTK_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')
+
+# Directories searched for the punkt model after NLTK_DATA, the same defaults as nltk.data.path
+NLTK_PATHS = [os.path.expanduser('~/nltk_data'), os.path.join(sys.prefix, 'nltk_data'),
+              os.path.join(sys.prefix, 'share', 'nltk_data'), os.path.join(sys.prefix, 'lib', 'nltk_data'),
+              '/usr/share/nltk_data', '/usr/local/share/nltk_data', '/usr/lib/nltk_data', '/usr/local/lib/nltk_data']
+
+# Resources of the punkt model, punkt_tab for recent NLTK and the pickled punkt model for older versions
+PUNKT_RESOURCES = ('tokenizers/punkt_tab/{language}', 'tokenizers/punkt/{language}.pickle')
+
+# Download punkt into NLTK_DATA when it is missing, off so workers never touch the network
+DOWNLOAD = False
+
+sentence_tokenizer = None
+punkt_models = {}
+word_tokenizer = None
+
+def word_sequence(line):
+    """
+    Splitting a line into words the same way as the Keras Tokenizer.
+
+    Args:
+        line (str): cleaned text line.
+
+    Returns:
+        words (array): lowercased words of the line.
+    """
+    return [word for word in line.lower().translate(TRANSLATE).split(' ') if word]
+
+def fit_word_index(flat_text):
+    """
+    Creating the word index of the tokenizer, most frequent word gets id 1.
+
+    Args:
+        flat_text (array): flatted texts from all story.
+
+    Returns:
+        word_index (dict): word -> token id.
+    """
+    word_counts = OrderedDict()
+    for line in flat_text:
+        for word in word_sequence(line):
+            word_counts[word] = word_counts.get(word, 0) + 1
+
+    # Stable sort, words with the same count keep their first appearance order
+    words = sorted(word_counts, key=word_counts.get, reverse=True)
+    return {word: i for i, word in enumerate(words, start=1)}
+
+class Tokenizer:
+    """
+    Drop-in replacement of the Keras Tokenizer for the default word level settings used by the checkers.
+
+    Args:
+        num_words (int): only the num_words - 1 most frequent words are kept in the sequences.
+        oov_token (str): token replacing the unknown words, unknown words are dropped when None.
+    """
+
+    def __init__(self, num_words=None, oov_token=None):
+        self.num_words = num_words
+        self.oov_token = oov_token
+        self.word_counts = OrderedDict()
+        self.word_index = {}
+
+    def fit_on_texts(self, texts):
+        """
+        Updating the word counts and the word index with the texts.
+
+        Args:
+            texts (array): text lines.
+        """
+        for line in texts:
+            for word in word_sequence(line):
+                self.word_counts[word] = self.word_counts.get(word, 0) + 1
+        words = sorted(self.word_counts, key=self.word_counts.get, reverse=True)
+        if self.oov_token is not None:
+            words = [self.oov_token] + words
+        self.word_index = {word: i for i, word in enumerate(words, start=1)}
+
+    def texts_to_sequences(self, texts):
+        """
+        Turning the texts into token ids.
+
+        Args:
+            texts (array): text lines.
+
+        Returns:
+            sequences (array): token ids of each line.
+        """
+        oov = self.word_index.get(self.oov_token)
+        sequences = []
+        for line in texts:
+            ids = []
+            for word in word_sequence(line):
+                i = self.word_index.get(word)
+                if i is not None and self.num_words and i >= self.num_words:
+                    i = None
+                if i is None:
+                    i = oov
+                if i is not None:
+                    ids.append(i)
+            sequences.append(ids)
+        return sequences
+
+def find_punkt(language='english'):
+    """
+    Finding the punkt model on disk, without importing NLTK.
+
+    Args:
+        language (str): punkt model language.
+
+    Returns:
+        root (str): nltk_data directory of the model, None if it is missing.
+        resource (str): resource of the model inside root.
+    """
+    roots = [NLTK_DATA] + [path for path in os.environ.get('NLTK_DATA', '').split(os.pathsep) if path] + NLTK_PATHS
+    for resource in PUNKT_RESOURCES:
+        resource = resource.format(language=language)
+        for root in roots:
+            if os.path.exists(os.path.join(root, resource)):
+                return root, resource
+    return None, None
+
+def sentence_model(language='english'):
+    """
+    Identifying the punkt model, the name and a hash of its files (part of the cleaned lines cache keys).
+
+    Args:
+        language (str): punkt model language.
+
+    Returns:
+        model (str): resource of the model and sha1 of its files.
+
+    Raises:
+        LookupError: the punkt model is missing.
+    """
+    if language not in punkt_models:
+        root, resource = find_punkt(language)
+        if root is None:
+            raise LookupError(f'punkt model ({language}) not found in {NLTK_DATA}, NLTK_DATA or the NLTK paths. Bundle it with: '
+                              "python -c \"import nltk; nltk.download('punkt_tab', download_dir='nltk_data')\"")
+        path = os.path.join(root, resource)
+        files = sorted(os.path.join(path, name) for name in os.listdir(path)) if os.path.isdir(path) else [path]
+        digest = hashlib.sha1()
+        for file in files:
+            digest.update(os.path.basename(file).encode('utf-8'))
+            with open(file, 'rb') as f:
+                digest.update(f.read())
+        punkt_models[language] = (root, resource, f'{resource}:{digest.hexdigest()[:12]}')
+    return punkt_models[language][2]
+
+def cleaner_namespace(cleaner, language='english'):
+    """
+    Creating the cache namespace of a cleaner, the cleaned lines depend on the punkt model that split them.
+
+    Args:
+        cleaner (str): name and version of the cleaner.
+        language (str): punkt model language.
+
+    Returns:
+        namespace (str): cleaner and punkt model.
+    """
+    return f'{cleaner}+{sentence_model(language)}'
+
+def load_punkt(language='english'):
+    """
+    Loading the punkt sentence tokenizer from disk.
+
+    Args:
+        language (str): punkt model language.
+
+    Returns:
+        tokenizer (object): tokenizer with a tokenize(text) method.
+
+    Raises:
+        LookupError: the punkt model is missing (and could not be downloaded when DOWNLOAD is set).
+    """
+    import nltk
+
+    if DOWNLOAD and find_punkt(language)[0] is None:
+        nltk.download('punkt_tab', download_dir=NLTK_DATA, quiet=True, raise_on_error=False)
+    sentence_model(language)
+    root, resource, _ = punkt_models[language]
+
+    # The model found by sentence_model is the one NLTK loads
+    if root in nltk.data.path:
+        nltk.data.path.remove(root)
+    nltk.data.path.insert(0, root)
+    if resource.startswith('tokenizers/punkt_tab/'):
+        from nltk.tokenize.punkt import PunktTokenizer
+        return PunktTokenizer(language)
+    return nltk.data.load(resource)
+
+def sent_tokenize(text):
+    """
+    Splitting a text into sentences with punkt (loaded on the first call).
+
+    Args:
+        text (str): text to be split.
+
+    Returns:
+        sentences (array): sentences of the text.
+    """
+    global sentence_tokenizer
+    if sentence_tokenizer is None:
+        sentence_tokenizer = load_punkt()
+    return sentence_tokenizer.tokenize(text)
+
+def word_tokenize(text, preserve_line=False):
+    """
+    Splitting a text into words like nltk.word_tokenize (NLTK is imported on the first call).
+
+    Args:
+        text (str): text to be split.
+        preserve_line (bool): the text is a single sentence, punkt is not needed.
+
+    Returns:
+        words (array): words of the text.
+    """
+    global word_tokenizer
+    if word_tokenizer is None:
+        from nltk.tokenize import NLTKWordTokenizer
+        word_tokenizer = NLTKWordTokenizer()
+    sentences = [text] if preserve_line else sent_tokenize(text)
+    return [word for sentence in sentences for word in word_tokenizer.tokenize(sentence)]
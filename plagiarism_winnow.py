@@ -0,0 +1,154 @@
+"""
+plagiarism_winnow.py: Winnowing fingerprints (MOSS) of the cleaned word stream, finding copied passages whose
+sentences were merged, split or reordered.
+
+Args:
+    text_list (array): list of cleaned texts of every chapter.
+    k (int): number of words in each k-gram.
+    window (int): number of consecutive k-grams in each winnowing window.
+
+Returns:
+    passages (dict): chapter position -> line of the checked chapter -> lines of that chapter sharing its fingerprints.
+
+The words of a chapter are one stream across its lines, so a k-gram can span a sentence boundary. Winnowing keeps
+the smallest hash of every window of k-grams, any passage of at least k + window - 1 common words shares a
+fingerprint. Fingerprints are looked up in a sorted inverted index, so a query is linear in the upload length.
+"""
+
+import hashlib
+
+import numpy as np
+
+from plagiarism_tokenizer import word_sequence
+
+K = 5
+WINDOW = 4
+
+# Chapter pairs sharing fewer fingerprints are common phrases, not copied passages
+MIN_SHARED = 3
+
+def word_stream(lines):
+    """
+    Creating the word stream of a chapter.
+
+    Args:
+        lines (array): cleaned text lines.
+
+    Returns:
+        words (array): words of every line.
+        line (np.ndarray): line of every word.
+    """
+    words = [word_sequence(text) for text in lines]
+    line = np.repeat(np.arange(len(lines)), [len(w) for w in words])
+    return [word for w in words for word in w], line
+
+def fingerprints(lines, k=K, window=WINDOW):
+    """
+    Winnowing the k-gram hashes of a chapter.
+
+    Args:
+        lines (array): cleaned text lines.
+        k (int): number of words in each k-gram.
+        window (int): number of consecutive k-grams in each winnowing window.
+
+    Returns:
+        hashes (np.ndarray): selected fingerprints.
+        start (np.ndarray): line of the first word of each fingerprint.
+        end (np.ndarray): line of the last word of each fingerprint.
+    """
+    words, line = word_stream(lines)
+    n = len(words) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    grams = np.fromiter((int.from_bytes(hashlib.blake2b(' '.join(words[i:i + k]).encode('utf-8'), digest_size=8).digest(), 'little')
+                         for i in range(n)), dtype=np.uint64, count=n)
+
+    # Rightmost smallest hash of every window, a repeated choice is one fingerprint
+    size = min(window, n)
+    windows = np.lib.stride_tricks.sliding_window_view(grams, size)
+    picked = np.arange(len(windows)) + size - 1 - np.argmin(windows[:, ::-1], axis=1)
+    picked = np.unique(picked)
+    return grams[picked], line[picked], line[picked + k - 1]
+
+def build_winnow(text_list, k=K, window=WINDOW):
+    """
+    Building the fingerprint -> location inverted index of the corpus.
+
+    Args:
+        text_list (array): list of cleaned texts of every chapter.
+        k (int): number of words in each k-gram.
+        window (int): number of consecutive k-grams in each winnowing window.
+
+    Returns:
+        winnow (dict): the inverted index, fingerprints sorted with their chapter, start and end lines.
+    """
+    found = [fingerprints(text, k, window) for text in text_list]
+    hashes = np.concatenate([f[0] for f in found] + [np.zeros(0, dtype=np.uint64)])
+    chapter = np.repeat(np.arange(len(text_list)), [len(f[0]) for f in found])
+    start = np.concatenate([f[1] for f in found] + [np.zeros(0, dtype=np.int64)])
+    end = np.concatenate([f[2] for f in found] + [np.zeros(0, dtype=np.int64)])
+
+    order = np.argsort(hashes, kind='stable')
+    return {'k': k, 'window': window, 'keys': hashes[order], 'chapter': chapter[order], 'start': start[order], 'end': end[order]}
+
+def add_winnow(winnow, text_list, start):
+    """
+    Appending new chapters to the inverted index, only their fingerprints are computed and merged into the sorted keys.
+
+    Args:
+        winnow (dict): the inverted index, it is not changed.
+        text_list (array): list of cleaned texts of the new chapters.
+        start (int): position of the first new chapter.
+
+    Returns:
+        winnow (dict): the inverted index of the old and the new chapters, the same as build_winnow on all of them.
+    """
+    new = build_winnow(text_list, winnow['k'], winnow['window'])
+    new['chapter'] = new['chapter'] + start
+
+    # New fingerprints go after the old ones with the same hash, the order of a stable sort over every chapter
+    at = np.searchsorted(winnow['keys'], new['keys'], side='right')
+    merged = dict(winnow)
+    for name in ('keys', 'chapter', 'start', 'end'):
+        merged[name] = np.insert(winnow[name], at, new[name].astype(winnow[name].dtype))
+    return merged
+
+def query_winnow(winnow, lines, exclude=None, min_shared=MIN_SHARED):
+    """
+    Finding the passages of the corpus sharing fingerprints with the chapter being checked.
+
+    Args:
+        winnow (dict): the inverted index.
+        lines (array): cleaned text lines of the chapter being checked.
+        exclude (int): chapter position to leave out (the chapter being checked).
+        min_shared (int): least number of common fingerprints for a chapter to be reported.
+
+    Returns:
+        passages (dict): chapter position -> line of the checked chapter -> sorted lines of that chapter.
+    """
+    hashes, start, end = fingerprints(lines, winnow['k'], winnow['window'])
+    lo = np.searchsorted(winnow['keys'], hashes, side='left')
+    hi = np.searchsorted(winnow['keys'], hashes, side='right')
+
+    shared = {}
+    common = {}
+    for f in np.flatnonzero(hi > lo):
+        for pos in range(lo[f], hi[f]):
+            j = int(winnow['chapter'][pos])
+            if j != exclude:
+                shared.setdefault(j, []).append((start[f], end[f], winnow['start'][pos], winnow['end'][pos]))
+                common.setdefault(j, set()).add(int(hashes[f]))
+
+    passages = {}
+    for j, hits in shared.items():
+        # Repeated lines give the same fingerprints again, only the distinct ones are counted
+        if len(common[j]) < min_shared:
+            continue
+        # Every line covered by the k-gram on one side matches every line covered on the other side
+        found = {}
+        for s1, e1, s2, e2 in hits:
+            for i in range(s1, e1 + 1):
+                found.setdefault(int(i), set()).update(range(s2, e2 + 1))
+        passages[j] = {i: sorted(opp) for i, opp in sorted(found.items())}
+    return passages
@@ -0,0 +1,305 @@
+"""
+search_ann_index.py: Approximate nearest neighbour index (IVF) of the fiction attribute vectors, finds the most
+similar fiction of the whole catalog without computing the similarity to every fiction.
+
+The sparse tfidf rows are projected on ANN_DIM random directions, the projected rows are clustered with spherical
+k-means and every fiction is listed under its nearest centroid. A query only reads the fiction listed under its
+nprobe nearest centroids and ranks them by their exact cosine similarity.
+
+Args:
+    matrix (sparse.csr_matrix): L2 normalized tfidf rows of every fiction.
+    query (sparse.csr_matrix): L2 normalized tfidf row of the query.
+
+Returns:
+    ann (dict): projection, centroids, projected rows and the list of every fiction.
+    neighbours (array): positions and cosine similarities of the nearest fiction, nearest first.
+
+Layout of ann_dir:
+    meta.json: number of fiction, lists and rows added since the lists were clustered.
+    projection.npy: random projection (tfidf columns x ANN_DIM).
+    centroids.npy: unit centroid of every list.
+    embeddings.npy: unit projected row of every fiction.
+    assign.npy: list of every fiction.
+"""
+
+import json
+import os
+
+import numpy as np
+
+# Number of random directions the tfidf rows are projected on
+ANN_DIM = 128
+
+# Lists read by a query
+NPROBE = 8
+
+# Iterations of spherical k-means when the lists are clustered
+KMEANS_ITERATIONS = 10
+
+# Recluster the lists once the added rows reach this fraction of the rows they were clustered with
+RECLUSTER_FRACTION = 0.2
+
+# Arrays of the index, each one is a .npy file opened with mmap_mode='r'
+ARRAYS = ('projection', 'centroids', 'embeddings', 'assign')
+
+def unit_rows(rows):
+    """
+    Scaling rows to unit length, zero rows stay zero.
+
+    Args:
+        rows (np.ndarray): the rows.
+
+    Returns:
+        np.ndarray: the unit rows.
+    """
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return rows / norms
+
+def project(ann, matrix):
+    """
+    Projecting tfidf rows on the random directions of the index.
+
+    Args:
+        ann (dict): the index.
+        matrix (sparse.csr_matrix): tfidf rows.
+
+    Returns:
+        np.ndarray: unit float32 projected rows.
+    """
+    return unit_rows(np.asarray(matrix @ ann['projection'], dtype=np.float32))
+
+def kmeans(embeddings, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Clustering unit rows with spherical k-means.
+
+    Args:
+        embeddings (np.ndarray): unit projected rows.
+        n_lists (int): number of clusters.
+        iterations (int): number of k-means iterations.
+        seed (int): seed of the first centroids.
+
+    Returns:
+        centroids (np.ndarray): unit centroid of every cluster.
+        assign (np.ndarray): cluster of every row.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = embeddings[rng.choice(len(embeddings), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(embeddings @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, embeddings)
+
+        # Empty clusters restart from a random row
+        empty = np.flatnonzero(~sums.any(axis=1))
+        sums[empty] = embeddings[rng.choice(len(embeddings), len(empty))]
+        centroids = unit_rows(sums)
+    return centroids, np.argmax(embeddings @ centroids.T, axis=1)
+
+def set_lists(ann):
+    """
+    Grouping the fiction by list, every list is a slice of ann['order'].
+
+    Args:
+        ann (dict): the index.
+    """
+    ann['order'] = np.argsort(ann['assign'], kind='stable')
+    ann['offsets'] = np.searchsorted(ann['assign'][ann['order']], np.arange(len(ann['centroids']) + 1))
+
+def cluster_lists(ann, seed=0):
+    """
+    Clustering the projected rows of the index again, after many rows were added.
+
+    Args:
+        ann (dict): the index.
+        seed (int): seed of the first centroids.
+    """
+    n_lists = max(1, min(len(ann['embeddings']), int(round(4 * np.sqrt(len(ann['embeddings']))))))
+    ann['centroids'], ann['assign'] = kmeans(np.asarray(ann['embeddings']), n_lists, seed=seed)
+    ann['clustered'], ann['added'] = len(ann['embeddings']), 0
+    set_lists(ann)
+
+def build_ann_index(matrix, dim=ANN_DIM, seed=0):
+    """
+    Building the index of the tfidf rows, about 4 * sqrt(rows) lists.
+
+    Args:
+        matrix (sparse.csr_matrix): L2 normalized tfidf rows of every fiction.
+        dim (int): number of random directions.
+        seed (int): seed of the projection and the first centroids.
+
+    Returns:
+        ann (dict): the index.
+    """
+    rng = np.random.default_rng(seed)
+    ann = {'projection': rng.standard_normal((matrix.shape[1], dim)).astype(np.float32) / np.sqrt(dim)}
+    ann['embeddings'] = project(ann, matrix)
+    if len(ann['embeddings']):
+        cluster_lists(ann, seed)
+    else:
+        ann.update({'centroids': np.zeros((0, dim), dtype=np.float32), 'assign': np.zeros(0, dtype=np.int64),
+                    'clustered': 0, 'added': 0})
+        set_lists(ann)
+    return ann
+
+def add_ann_items(ann, matrix, recluster_fraction=RECLUSTER_FRACTION):
+    """
+    Adding fiction to the index, every new row is listed under its nearest centroid. The lists are clustered again
+    once the added rows reach recluster_fraction of the clustered rows.
+
+    Args:
+        ann (dict): the index.
+        matrix (sparse.csr_matrix): L2 normalized tfidf rows of the new fiction (vocabulary of the index).
+        recluster_fraction (float): fraction of added rows that starts a new clustering.
+
+    Returns:
+        positions (np.ndarray): positions of the new fiction in the index.
+    """
+    embeddings = project(ann, matrix)
+    start = len(ann['embeddings'])
+    ann['embeddings'] = np.concatenate([ann['embeddings'], embeddings])
+    if not len(ann['centroids']):
+        cluster_lists(ann)
+    else:
+        ann['assign'] = np.concatenate([ann['assign'], np.argmax(embeddings @ np.asarray(ann['centroids']).T, axis=1)])
+        ann['added'] += len(embeddings)
+        if ann['added'] >= recluster_fraction * ann['clustered']:
+            cluster_lists(ann)
+        else:
+            set_lists(ann)
+    return np.arange(start, start + len(embeddings))
+
+def ann_candidates(ann, query, nprobe=NPROBE):
+    """
+    Getting the fiction listed under the nearest centroids of the query.
+
+    Args:
+        ann (dict): the index.
+        query (sparse.csr_matrix): tfidf row of the query.
+        nprobe (int): number of lists read.
+
+    Returns:
+        np.ndarray: positions of the candidate fiction.
+    """
+    if not len(ann['centroids']):
+        return np.zeros(0, dtype=np.int64)
+    closeness = np.asarray(ann['centroids']) @ project(ann, query)[0]
+    nprobe = min(nprobe, len(closeness))
+    lists = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+    offsets = ann['offsets']
+    return np.concatenate([ann['order'][offsets[i]:offsets[i + 1]] for i in lists])
+
+def ann_neighbours(ann, matrix, query, top_k=10, nprobe=NPROBE):
+    """
+    Finding the most similar fiction of the query, the candidates are ranked by exact cosine similarity.
+
+    Args:
+        ann (dict): the index.
+        matrix (sparse.csr_matrix): L2 normalized tfidf rows of every fiction in the index.
+        query (sparse.csr_matrix): L2 normalized tfidf row of the query.
+        top_k (int): number of neighbours.
+        nprobe (int): number of lists read.
+
+    Returns:
+        positions (np.ndarray): positions of the neighbours, nearest first (ties keep the catalog order).
+        similarity (np.ndarray): cosine similarity of each neighbour.
+    """
+    candidates = np.sort(ann_candidates(ann, query, nprobe))
+    similarity = (matrix[candidates] @ query.T).toarray().ravel()
+    top_k = min(top_k, len(candidates))
+    if top_k <= 0:
+        return candidates, similarity
+    top = np.argpartition(-similarity, top_k - 1)[:top_k]
+    top = top[np.lexsort((top, -similarity[top]))]
+    return candidates[top], similarity[top]
+
+def write_ann_index(ann_dir, ann):
+    """
+    Writing the index.
+
+    Args:
+        ann_dir (str): directory of the index, created when missing.
+        ann (dict): the index.
+    """
+    os.makedirs(ann_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(ann_dir, name + '.npy'), ann[name])
+    with open(os.path.join(ann_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'items': len(ann['embeddings']), 'lists': len(ann['centroids']),
+                   'clustered': ann['clustered'], 'added': ann['added']}, f)
+
+def open_ann_index(ann_dir):
+    """
+    Opening the index, the arrays are memory-mapped read-only (add_ann_items copies them into memory).
+
+    Args:
+        ann_dir (str): directory of the index.
+
+    Returns:
+        ann (dict): the index, None if it does not exist.
+    """
+    try:
+        with open(os.path.join(ann_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    ann = {'clustered': meta['clustered'], 'added': meta['added']}
+    for name in ARRAYS:
+        ann[name] = np.load(os.path.join(ann_dir, name + '.npy'), mmap_mode='r')
+    set_lists(ann)
+    return ann
+
+def recall_at_k(ann, matrix, queries, k=10, nprobe=NPROBE):
+    """
+    Measuring the recall of the index against exact search.
+
+    Args:
+        ann (dict): the index.
+        matrix (sparse.csr_matrix): L2 normalized tfidf rows of every fiction in the index.
+        queries (array): positions of the fiction used as queries.
+        k (int): number of neighbours compared.
+        nprobe (int): number of lists read.
+
+    Returns:
+        float: mean fraction of the exact top k found by the index.
+    """
+    found = 0
+    for position in queries:
+        query = matrix[position]
+        exact = (matrix @ query.T).toarray().ravel()
+        top = np.argpartition(-exact, k - 1)[:k]
+        # Items tied with the k-th exact similarity are all correct answers
+        correct = exact >= exact[top].min() - 1e-12
+        positions, _ = ann_neighbours(ann, matrix, query, k, nprobe)
+        found += min(k, int(correct[positions].sum()))
+    return found / (k * len(queries))
+
+# Check: python search_ann_index.py [fiction] (recall@10 against exact search on random tfidf rows)
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = np.random.default_rng(1)
+    topics = rng.integers(0, 3000, size=(200, 40))
+    docs = [' '.join(f'w{word}' for word in rng.choice(topics[rng.integers(200)], 25)) + ' ' +
+            ' '.join(f'w{word}' for word in rng.integers(0, 3000, 10)) for _ in range(n)]
+    matrix = TfidfVectorizer().fit_transform(docs).tocsr()
+
+    start = time.perf_counter()
+    ann = build_ann_index(matrix[:n - n // 10])
+    add_ann_items(ann, matrix[n - n // 10:])
+    print(f'built {n} rows in {time.perf_counter() - start:.2f}s, {len(ann["centroids"])} lists')
+    queries = rng.choice(n, 200, replace=False)
+    start = time.perf_counter()
+    for position in queries:
+        (matrix @ matrix[position].T).toarray()
+    print(f'exact search {(time.perf_counter() - start) / len(queries) * 1e3:.2f} ms per query')
+    for nprobe in (2, 4, 8, 16):
+        start = time.perf_counter()
+        for position in queries:
+            ann_neighbours(ann, matrix, matrix[position], 10, nprobe)
+        elapsed = (time.perf_counter() - start) / len(queries) * 1e3
+        print(f'nprobe={nprobe} recall@10={recall_at_k(ann, matrix, queries, 10, nprobe):.3f} {elapsed:.2f} ms per query')
@@ -6,23 +6,58 @@ Args:
     rating_dir (str): The directory for rating data. Default is 'https://readscape.live/calculatedrating'.
     fiction_dir (str): The directory of the fiction data.
 
+    model_dir (str, optional): directory of the prebuilt content model, built once from the source data and
+                               rebuilt only when the hash of the source data changes.
+
 Returns:
     json: The top 10 recommended fanfiction titles.
+
+Layout of model_dir:
+    CURRENT: name of the active version directory (the hash of the source data it was built from).
+    <version>/meta.json: model format, source hash and number of items.
+    <version>/attribute_vocabulary.json, attribute_idf.npy: fitted attribute vectorizer (word -> column and IDF weights).
+    <version>/attribute_data.npy, attribute_indices.npy, attribute_indptr.npy: L2 normalized CSR attribute matrix (score order).
+    <version>/score.npy: score of every item (score order).
+    <version>/items.json: fiction_id and title of every item (score order) and titles in fiction order.
+    <version>/fiction.json: fiction_id, title, tags and synopsis of the fiction, joined to the recommendations.
+    <version>/title_index/: character n-gram index of the titles (search_title_index.py) for typo tolerant lookups.
+    <version>/ann/: approximate nearest neighbour index of the attribute rows (search_ann_index.py).
 """
 
+import hashlib
+import json
+import os
+import shutil
 import string
 import re
+import uuid
+import sys
 import pandas as pd
 import numpy as np
 import requests
+from scipy import sparse
+
+from sklearn.preprocessing import MinMaxScaler, normalize
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from search_title_index import build_title_index, write_title_index, open_title_index, title_candidates
+from search_ann_index import build_ann_index, write_ann_index, open_ann_index, add_ann_items, ann_candidates, ann_neighbours
 
 import warnings
 warnings.filterwarnings('ignore')
 
+# Format of the prebuilt model, part of the source hash so a new format rebuilds the model
+MODEL_FORMAT = 'content-model-v4'
+
+# Matrices of the prebuilt model, each one is saved as CSR .npy arrays opened with mmap_mode='r'
+MATRICES = ('attribute',)
+
+# Similarities held at once by recommend_batch (catalog items x titles of a block), 2**22 float64 is 32 MB
+BATCH_CELLS = 2**22
+
+# Loaded model versions, a version is read from disk once per process
+loaded_models = {}
+
 def preprocess_rating(rating):
     """
     Preprocesses the rating data.
@@ -112,7 +147,7 @@ def preprocess_content(content_df):
 
 def similar_title(title, fiction):
     """
-    Finds the most similar title based on content similarity.
+    Finds the most similar title without a prebuilt model, like model_title.
 
     Args:
         title (str): The input title.
@@ -121,16 +156,29 @@ def similar_title(title, fiction):
     Returns:
         str: The most similar title.
     """
-    vectorizer = TfidfVectorizer()
-    tfidf = vectorizer.fit_transform(fiction['title_mod'])
-    vector_title = vectorizer.transform([title])
-    similarity = cosine_similarity(vector_title, tfidf).flatten()
-    index = np.argmax(similarity)
-    return fiction['title'].iloc[index]
+    titles = fiction['title'].tolist()
+    return model_title(title, {'title_index': build_title_index(titles), 'titles': titles})
+
+def top_indices(scores, top_n):
+    """
+    Selects the positions of the highest scores without sorting the whole catalog.
+
+    Args:
+        scores (np.ndarray): The score of every item.
+        top_n (int): The number of positions to return.
+
+    Returns:
+        np.ndarray: The positions of the top_n highest scores, highest first (ties keep the catalog order).
+    """
+    top_n = min(top_n, len(scores))
+    if top_n <= 0:
+        return np.zeros(0, dtype=int)
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    return top[np.lexsort((top, -scores[top]))]
 
 def predict(title, fiction, content_df, similarity_weight, top_n):
     """
-    Predicts the top recommended fiction based on content similarity and popularity.
+    Predicts the top recommended fiction without a prebuilt model, the model is fitted for this call (see recommend).
 
     Args:
         title (str): The input title.
@@ -142,39 +190,22 @@ def predict(title, fiction, content_df, similarity_weight, top_n):
     Returns:
         pd.DataFrame: The top recommended fiction.
     """
-    data = content_df.reset_index()
-    index_movie = data[data['title'] == title].index
-
-    tfidf = TfidfVectorizer()
-    tfidf_matrix = tfidf.fit_transform(content_df['atribute'])
-    cos_sim = cosine_similarity(tfidf_matrix)
-    similarity = cos_sim[index_movie].T
+    return recommend(title, fit_model(fiction, content_df), similarity_weight, top_n)
 
-    content_df['similarity'] = pd.DataFrame(similarity, columns=['similarity'])
-    content_df['final_score'] = content_df['score']*(1-similarity_weight) + content_df['similarity']*similarity_weight
-    content_df_sorted = content_df.sort_values(by='final_score', ascending=False).head(top_n)
-    content_df_sorted.set_index('title', inplace=True)
-    merged_df = content_df_sorted.merge(fiction, on='fiction_id', how='left')
-    
-    return merged_df[['fiction_id','title','tags','synopsis', 'final_score']]
-
-def search_recommendation_content(title, rating_dir='https://readscape.live/calculatedrating', fiction_dir='https://readscape.live/fiction'):
+def prepare_catalog(rating_data, fiction_data):
     """
-    Searches for book recommendations based on content similarity.
+    Preparing the fiction and content dataframes from the source data.
 
     Args:
-        title (str): The input title.
-        rating_dir (str): The directory for rating data. Default is 'https://readscape.live/calculatedrating'.
-        fiction_dir (str): The directory for fiction data. Default is 'https://readscape.live/fiction'.
+        rating_data (array): rows of the rating data.
+        fiction_data (array): rows of the fiction data.
 
     Returns:
-        pd.DataFrame: The top recommended fiction.
+        fiction (pd.DataFrame): The fiction data merged with the rating data.
+        content_df (pd.DataFrame): The preprocessed content dataframe sorted by score.
     """
-    rating_dir = requests.get(rating_dir).json()
-    fiction_dir = requests.get(fiction_dir).json()
-
-    rating = pd.DataFrame(rating_dir['data'])
-    fiction = pd.DataFrame(fiction_dir['data'])
+    rating = pd.DataFrame(rating_data)
+    fiction = pd.DataFrame(fiction_data)
 
     fiction['title_mod'] = fiction["title"].str.replace("[^a-zA-Z0-9 ]", "").str.lower().str.replace("\s+", " ", regex=True)
 
@@ -186,13 +217,494 @@ def search_recommendation_content(title, rating_dir='https://readscape.live/calc
 
     content_df = fiction[['fiction_id', 'title', 'synopsis', 'tags', 'chapters']]
     content_df = preprocess_content(content_df)   
-    content_df = rating_pred_sorted[:10000].merge(content_df, left_index=True, right_index=True, how='left')
+    content_df = rating_pred_sorted.merge(content_df, left_index=True, right_index=True, how='left')
     content_df = content_df.reset_index()
+    return fiction, content_df
+
+def source_hash(rating_data, fiction_data):
+    """
+    Hashing the source data, the model is rebuilt only when this hash changes.
+
+    Args:
+        rating_data (array): rows of the rating data.
+        fiction_data (array): rows of the fiction data.
+
+    Returns:
+        str: sha1 hex digest of the model format and the source data.
+    """
+    payload = json.dumps([MODEL_FORMAT, rating_data, fiction_data], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def fit_model(fiction, content_df):
+    """
+    Fitting the attribute vectorizer once for the whole catalog.
+
+    Args:
+        fiction (pd.DataFrame): The fiction data.
+        content_df (pd.DataFrame): The preprocessed content dataframe.
+
+    Returns:
+        dict: The model, fitted attribute vectorizer, L2 normalized attribute matrix, title and ANN indexes, ids,
+              titles and scores.
+    """
+    model = {'path': None}
+    vectorizer = TfidfVectorizer()
+    model['attribute'] = vectorizer.fit_transform(content_df['atribute']).tocsr()
+    model['attribute_counter'] = CountVectorizer(vocabulary=vectorizer.vocabulary_)
+    model['attribute_idf'] = vectorizer.idf_
+
+    model['titles'] = fiction['title'].tolist()
+    model['title_index'] = build_title_index(model['titles'])
+    model['ids'] = content_df['fiction_id'].tolist()
+    model['ann'] = build_ann_index(model['attribute'])
+    model['content_titles'] = content_df['title'].tolist()
+    model['score'] = content_df['score'].to_numpy(dtype=np.float64)
+    model['fiction'] = fiction[['fiction_id', 'title', 'tags', 'synopsis']]
+    return model
+
+def write_model(model_dir, version, model):
+    """
+    Writing a fitted model as a version of model_dir, it only appears once every file is written.
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+        version (str): name of the version directory.
+        model (dict): The fitted model.
+    """
+    path = os.path.join(model_dir, version)
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp)
+    for name in MATRICES:
+        matrix = model[name]
+        matrix.sort_indices()
+        # int32 CSR indices as long as they fit, so scipy maps the arrays without converting them
+        index_dtype = np.int32 if matrix.nnz < 2**31 and matrix.shape[1] < 2**31 else np.int64
+        np.save(os.path.join(tmp, name + '_data.npy'), matrix.data.astype(np.float64))
+        np.save(os.path.join(tmp, name + '_indices.npy'), matrix.indices.astype(index_dtype))
+        np.save(os.path.join(tmp, name + '_indptr.npy'), matrix.indptr.astype(index_dtype))
+        np.save(os.path.join(tmp, name + '_idf.npy'), model[name + '_idf'])
+        with open(os.path.join(tmp, name + '_vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump({word: int(col) for word, col in model[name + '_counter'].vocabulary.items()}, f)
+    write_title_index(os.path.join(tmp, 'title_index'), model['title_index'])
+    write_ann_index(os.path.join(tmp, 'ann'), model['ann'])
+    np.save(os.path.join(tmp, 'score.npy'), model['score'])
+    with open(os.path.join(tmp, 'items.json'), 'w', encoding='utf-8') as f:
+        json.dump({'ids': model['ids'], 'content_titles': model['content_titles'], 'titles': model['titles']}, f)
+    model['fiction'].to_json(os.path.join(tmp, 'fiction.json'), orient='records')
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'format': MODEL_FORMAT, 'source_hash': version, 'items': len(model['ids']),
+                   'fiction': len(model['titles'])}, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+def current_version(model_dir):
+    """
+    Getting the name of the active model version.
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+
+    Returns:
+        str: name of the active version, None if no model was built yet.
+    """
+    try:
+        with open(os.path.join(model_dir, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def set_current_version(model_dir, version):
+    """
+    Switching the active model version. The previous version is kept for the processes that loaded it before the
+    switch (they only read their own version), the older versions are removed.
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+        version (str): name of the version directory.
+    """
+    keep = (version, current_version(model_dir))
+    tmp = os.path.join(model_dir, 'CURRENT.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(model_dir, 'CURRENT'))
+
+    for name in os.listdir(model_dir):
+        if name not in keep and os.path.isdir(os.path.join(model_dir, name)) and not name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(model_dir, name), ignore_errors=True)
+    evict_models(model_dir, keep)
+
+def evict_models(model_dir, keep):
+    """
+    Dropping the loaded versions of model_dir that are no longer kept, a search still holding one keeps reading it.
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+        keep (array): names of the versions that stay loaded.
+    """
+    for path in list(loaded_models):
+        if os.path.normpath(os.path.dirname(path)) == os.path.normpath(model_dir) and os.path.basename(path) not in keep:
+            loaded_models.pop(path, None)
+
+def load_model(model_dir, version=None):
+    """
+    Loading a model version once, the matrices and scores are memory-mapped and nothing is refitted.
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+        version (str): name of the version directory, default is the active version.
+
+    Returns:
+        dict: The model, None if no model was built yet.
+    """
+    version = version or current_version(model_dir)
+    if version is None:
+        return None
+    path = os.path.join(model_dir, version)
+    if path in loaded_models:
+        return loaded_models[path]
+
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    with open(os.path.join(path, 'items.json'), encoding='utf-8') as f:
+        items = json.load(f)
+    model = {'path': path, 'source_hash': meta['source_hash'], 'titles': items['titles'],
+             'ids': items['ids'], 'content_titles': items['content_titles'],
+             'title_index': open_title_index(os.path.join(path, 'title_index')),
+             'ann': open_ann_index(os.path.join(path, 'ann')),
+             'score': np.load(os.path.join(path, 'score.npy'), mmap_mode='r'),
+             'fiction': pd.read_json(os.path.join(path, 'fiction.json'), orient='records', dtype=False)}
+    for name in MATRICES:
+        with open(os.path.join(path, name + '_vocabulary.json'), encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        arrays = [np.load(os.path.join(path, f'{name}_{part}.npy'), mmap_mode='r') for part in ('data', 'indices', 'indptr')]
+        model[name] = sparse.csr_matrix(tuple(arrays), shape=(len(arrays[2]) - 1, len(vocabulary)), copy=False)
+        model[name + '_counter'] = CountVectorizer(vocabulary=vocabulary)
+        model[name + '_idf'] = np.load(os.path.join(path, name + '_idf.npy'))
+    loaded_models[path] = model
+    evict_models(model_dir, (version, current_version(model_dir)))
+    return model
+
+def build_model(model_dir, rating_data, fiction_data):
+    """
+    Building the model from the source data, unless the active version was built from the same data.
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+        rating_data (array): rows of the rating data.
+        fiction_data (array): rows of the fiction data.
+
+    Returns:
+        dict: The loaded model of the source data.
+    """
+    version = source_hash(rating_data, fiction_data)
+    if current_version(model_dir) != version:
+        os.makedirs(model_dir, exist_ok=True)
+        write_model(model_dir, version, fit_model(*prepare_catalog(rating_data, fiction_data)))
+        set_current_version(model_dir, version)
+    return load_model(model_dir, version)
+
+def update_model(model_dir, rating_dir='https://readscape.live/calculatedrating', fiction_dir='https://readscape.live/fiction'):
+    """
+    Downloading the source data and rebuilding the model when its hash changed (run on a schedule).
+
+    Args:
+        model_dir (str): directory of the prebuilt model.
+        rating_dir (str): The directory for rating data. Default is 'https://readscape.live/calculatedrating'.
+        fiction_dir (str): The directory for fiction data. Default is 'https://readscape.live/fiction'.
+
+    Returns:
+        dict: The loaded model of the current source data.
+    """
+    rating_data = requests.get(rating_dir).json()['data']
+    fiction_data = requests.get(fiction_dir).json()['data']
+    return build_model(model_dir, rating_data, fiction_data)
+
+def add_items(model, fiction):
+    """
+    Adding new fiction to a model in memory, so it is recommended and found before the next build. The new rows are
+    vectorized with the fitted attribute vectorizer and appended to the matrix, ids, titles and scores before the ANN
+    index is extended, the model on disk is unchanged.
 
-    title = similar_title(title, fiction)
-    recommendation = predict(title, fiction, content_df, 0.9, 10)
+    Args:
+        model (dict): The model.
+        fiction (pd.DataFrame): fiction_id, title, synopsis, tags and chapters of the new fiction, and its score on the
+                                scale of the model (0 when there is no 'score' column, new fiction has no rating yet).
+
+    Returns:
+        np.ndarray: positions of the new fiction in the model.
+    """
+    fiction = preprocess_fiction(fiction.copy())
+    content_df = preprocess_content(fiction[['fiction_id', 'title', 'synopsis', 'tags', 'chapters']].copy()).reset_index()
+    counts = model['attribute_counter'].transform(content_df['atribute'])
+    rows = normalize(sparse.csr_matrix(counts.multiply(model['attribute_idf'])))
+    score = fiction['score'].to_numpy(dtype=np.float64) if 'score' in fiction else np.zeros(len(fiction))
+
+    model['attribute'] = sparse.vstack([model['attribute'], rows], format='csr')
+    model['ids'] = model['ids'] + content_df['fiction_id'].tolist()
+    model['content_titles'] = model['content_titles'] + content_df['title'].tolist()
+    model['score'] = np.concatenate([model['score'], score])
+    model['titles'] = model['titles'] + fiction['title'].tolist()
+    model['fiction'] = pd.concat([model['fiction'], fiction[['fiction_id', 'title', 'tags', 'synopsis']]], ignore_index=True)
+    model['title_index'] = build_title_index(model['titles'])
+    for name in ('id_positions', 'title_positions'):
+        model.pop(name, None)
+    return add_ann_items(model['ann'], rows)
+
+def model_title(title, model):
+    """
+    Finds the most similar title with the character n-gram title index of the model, partial and misspelled
+    words still match.
+
+    Args:
+        title (str): The input title.
+        model (dict): The model.
+
+    Returns:
+        str: The most similar title (the first title when nothing matches, like an argmax of zeros).
+    """
+    positions, _ = title_candidates(model['title_index'], title, 1)
+    return model['titles'][int(positions[0]) if len(positions) else 0]
+
+def title_suggestions(title, model, top_n=10):
+    """
+    Suggests the titles matching the text typed so far, for autocomplete.
+
+    Args:
+        title (str): The text typed so far, the last word may be unfinished.
+        model (dict): The model.
+        top_n (int): The number of suggestions.
+
+    Returns:
+        pd.DataFrame: fiction_id, title and score of the suggested titles, best first.
+    """
+    positions, scores = title_candidates(model['title_index'], title, top_n)
+    fiction_ids = model['fiction']['fiction_id']
+    return pd.DataFrame({'fiction_id': [fiction_ids.iat[i] for i in positions],
+                         'title': [model['titles'][i] for i in positions], 'score': scores})
+
+def recommend(title, model, similarity_weight, top_n, nprobe=None):
+    """
+    Predicts the top recommended fiction with the prebuilt attribute matrix of the model.
+
+    Args:
+        title (str): The title of an item of the model.
+        model (dict): The model.
+        similarity_weight (float): The weight for content similarity.
+        top_n (int): The number of recommendations to return.
+        nprobe (int): lists of the ANN index read for the candidates, None compares the title with every item.
+
+    Returns:
+        pd.DataFrame: The top recommended fiction.
+    """
+    index_movie = model['content_titles'].index(title)
+    attribute = model['attribute']
+    query = attribute[index_movie]
+
+    # Candidates of the ANN index and the items with the best scores, instead of the whole catalog (the rows are not
+    # sorted by score, added items go last, so the best scores are selected rather than taken from the first rows)
+    if nprobe:
+        rows = np.union1d(ann_candidates(model['ann'], query, nprobe), top_indices(np.asarray(model['score']), top_n))
+    else:
+        rows = np.arange(len(model['ids']))
+
+    # Rows are L2 normalized, so one sparse matrix-vector product gives the cosine similarity to every item
+    similarity = (attribute[rows] @ query.T).toarray().ravel()
+
+    final_score = np.asarray(model['score'])[rows]*(1-similarity_weight) + similarity*similarity_weight
+    top = top_indices(final_score, top_n)
+    return recommendation_frame(model, rows[top], similarity[top], final_score[top])
+
+def recommendation_frame(model, positions, similarity, final_score, query=None):
+    """
+    Joining the recommended items to the fiction data.
+
+    Args:
+        model (dict): The model.
+        positions (np.ndarray): positions of the recommended items, best first.
+        similarity (np.ndarray): content similarity of each item.
+        final_score (np.ndarray): final score of each item.
+        query (np.ndarray): query of each item when several queries are joined at once, kept as the 'query' column.
+
+    Returns:
+        pd.DataFrame: The top recommended fiction.
+    """
+    content_df_sorted = pd.DataFrame({'fiction_id': [model['ids'][i] for i in positions],
+                                      'similarity': similarity, 'final_score': final_score})
+    columns = ['fiction_id','title','tags','synopsis', 'final_score']
+    if query is not None:
+        content_df_sorted['query'] = query
+        columns = ['query'] + columns
+    fiction = model['fiction']
+    merged_df = content_df_sorted.merge(fiction[fiction['fiction_id'].isin(content_df_sorted['fiction_id'])], on='fiction_id', how='left')
+
+    return merged_df[columns]
+
+def query_position(query, model, fiction_id=False):
+    """
+    Resolving a typed title or a fiction_id to its item of the model.
+
+    Args:
+        query (str): a title resolved like model_title, or the fiction_id of an item.
+        model (dict): The model.
+        fiction_id (bool): query is a fiction_id, a title made of digits is still resolved as a title otherwise.
+
+    Returns:
+        int: position of the item.
+    """
+    if 'id_positions' not in model:
+        model['id_positions'] = {item_id: i for i, item_id in reversed(list(enumerate(model['ids'])))}
+        model['title_positions'] = {title: i for i, title in reversed(list(enumerate(model['content_titles'])))}
+    if fiction_id:
+        return model['id_positions'][str(query)]
+    return model['title_positions'][model_title(query, model)]
+
+def recommend_batch(queries, model, similarity_weight, top_n, fiction_ids=False):
+    """
+    Predicts the top recommended fiction of several titles at once, one sparse matrix-matrix product against the
+    catalog gives the similarity of every item to a block of titles.
+
+    Args:
+        queries (array): titles (resolved like model_title), or fiction_ids when fiction_ids is True.
+        model (dict): The model.
+        similarity_weight (float): The weight for content similarity.
+        top_n (int): The number of recommendations of each title.
+        fiction_ids (bool): the queries are fiction_ids.
+
+    Returns:
+        array: The top recommended fiction of each query, like recommend.
+    """
+    attribute = model['attribute']
+    score = np.asarray(model['score'])*(1-similarity_weight)
+    positions = [query_position(query, model, fiction_ids) for query in queries]
+    if not positions:
+        return []
+
+    # Only one dense block of similarities, the final score is computed one title at a time
+    columns = max(1, BATCH_CELLS // max(1, attribute.shape[0]))
+    tops, similarities, final_scores = [], [], []
+    for start in range(0, len(positions), columns):
+        similarity = (attribute @ attribute[positions[start:start + columns]].T).toarray()
+        for j in range(similarity.shape[1]):
+            final_score = score + similarity[:, j]*similarity_weight
+            top = top_indices(final_score, top_n)
+            tops.append(top)
+            similarities.append(similarity[top, j])
+            final_scores.append(final_score[top])
+
+    # The items of every query are joined to the fiction data at once, then split by query
+    query = np.repeat(np.arange(len(tops)), [len(top) for top in tops])
+    merged_df = recommendation_frame(model, np.concatenate(tops), np.concatenate(similarities),
+                                     np.concatenate(final_scores), query)
+    groups = dict(tuple(merged_df.groupby('query', sort=False)))
+    empty = merged_df.iloc[:0]
+    return [groups.get(j, empty).drop(columns='query').reset_index(drop=True) for j in range(len(tops))]
+
+def similar_fiction(fiction_id, model, top_n=10, nprobe=None):
+    """
+    Finds the fiction with the most similar content to a fiction of the catalog, with the ANN index of the model.
+
+    Args:
+        fiction_id (str): The fiction.
+        model (dict): The model.
+        top_n (int): The number of similar fiction to return.
+        nprobe (int): lists of the ANN index read, default is search_ann_index.NPROBE.
+
+    Returns:
+        pd.DataFrame: fiction_id, title and similarity of the most similar fiction, most similar first.
+    """
+    attribute = model['attribute']
+    position = model['ids'].index(str(fiction_id))
+    options = {'nprobe': nprobe} if nprobe else {}
+    positions, similarity = ann_neighbours(model['ann'], attribute, attribute[position], top_n + 1, **options)
+    keep = positions != position
+    positions, similarity = positions[keep][:top_n], similarity[keep][:top_n]
+    return pd.DataFrame({'fiction_id': [model['ids'][i] for i in positions],
+                         'title': [model['content_titles'][i] for i in positions], 'similarity': similarity})
+
+def search_model(rating_dir, fiction_dir, model_dir=None):
+    """
+    Getting the model a search answers from. The source hash is not checked here, a search does not download the
+    source data: the model only follows catalog changes once the scheduled build (update_model) switches the active
+    version, which the next search loads.
+
+    Args:
+        rating_dir (str): The directory for rating data.
+        fiction_dir (str): The directory for fiction data.
+        model_dir (str): directory of the prebuilt model, the source data is only downloaded when no model was built
+                         yet. None downloads the data and fits the model for this call.
+
+    Returns:
+        dict: The model.
+    """
+    model = load_model(model_dir) if model_dir else None
+    if model is None and model_dir:
+        model = update_model(model_dir, rating_dir, fiction_dir)
+    elif model is None:
+        rating_data = requests.get(rating_dir).json()['data']
+        fiction_data = requests.get(fiction_dir).json()['data']
+        model = fit_model(*prepare_catalog(rating_data, fiction_data))
+    return model
+
+def search_recommendation_content(title, rating_dir='https://readscape.live/calculatedrating', fiction_dir='https://readscape.live/fiction', model_dir=None):
+    """
+    Searches for book recommendations based on content similarity.
+
+    Args:
+        title (str): The input title.
+        rating_dir (str): The directory for rating data. Default is 'https://readscape.live/calculatedrating'.
+        fiction_dir (str): The directory for fiction data. Default is 'https://readscape.live/fiction'.
+        model_dir (str): directory of the prebuilt model (see search_model).
+
+    Returns:
+        pd.DataFrame: The top recommended fiction.
+    """
+    model = search_model(rating_dir, fiction_dir, model_dir)
+    title = model_title(title, model)
+    recommendation = recommend(title, model, 0.9, 10)
     
     return recommendation.to_json()
 
-#test for title 'golden'
-search_recommendation_content('golden')
+def search_recommendation_batch(titles, rating_dir='https://readscape.live/calculatedrating', fiction_dir='https://readscape.live/fiction', model_dir=None, top_n=10, fiction_ids=False):
+    """
+    Searches for book recommendations of several titles or fiction_ids at once (recommendation shelves), the data
+    is loaded once for the whole batch.
+
+    Args:
+        titles (array): The input titles, or fiction_ids when fiction_ids is True.
+        rating_dir (str): The directory for rating data. Default is 'https://readscape.live/calculatedrating'.
+        fiction_dir (str): The directory for fiction data. Default is 'https://readscape.live/fiction'.
+        model_dir (str): directory of the prebuilt model (see search_model).
+        top_n (int): The number of recommendations of each title.
+        fiction_ids (bool): titles are fiction_ids of the catalog instead of typed titles.
+
+    Returns:
+        json: input title -> its recommendations, in the json of search_recommendation_content.
+    """
+    model = search_model(rating_dir, fiction_dir, model_dir)
+    recommendations = recommend_batch(titles, model, 0.9, top_n, fiction_ids)
+    return json.dumps({str(title): json.loads(recommendation.to_json()) for title, recommendation in zip(titles, recommendations)})
+
+def search_title_suggestions(title, rating_dir='https://readscape.live/calculatedrating', fiction_dir='https://readscape.live/fiction', model_dir=None, top_n=10):
+    """
+    Suggests titles for the text typed in the search box, misspelled and unfinished words still match.
+
+    Args:
+        title (str): The text typed so far.
+        rating_dir (str): The directory for rating data. Default is 'https://readscape.live/calculatedrating'.
+        fiction_dir (str): The directory for fiction data. Default is 'https://readscape.live/fiction'.
+        model_dir (str): directory of the prebuilt model, like search_recommendation_content.
+        top_n (int): The number of suggestions.
+
+    Returns:
+        json: fiction_id, title and score of the suggested titles.
+    """
+    return title_suggestions(title, search_model(rating_dir, fiction_dir, model_dir), top_n).to_json()
+
+# Check: python search_recommendation_content.py [build <model_dir>]
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['build']:
+        update_model(sys.argv[2] if len(sys.argv) > 2 else 'content_model')
+    else:
+        #test for title 'golden'
+        search_recommendation_content('golden')
@@ -0,0 +1,183 @@
+"""
+search_title_index.py: Character n-gram index of the fiction titles, finds titles from partial or misspelled
+input ("gold", "goldn" -> "Golden ...") for the title search and autocomplete.
+
+Args:
+    titles (array): title of every fiction.
+    query (str): text typed by the user, the last word may be unfinished.
+
+Returns:
+    index (dict): gram vocabulary, IDF weights, posting lists (title positions of every gram) and title norms.
+    candidates (array): positions and scores of the best matching titles, best first.
+
+Layout of index_dir:
+    grams.json: character n-grams (gram -> column).
+    idf.npy: IDF weight of every gram.
+    postings.npy, posting_offsets.npy: int32 title positions of every gram and the first posting of each gram.
+    norms.npy: L2 norm of the IDF weights of every title.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+# Length of the character n-grams, words are padded so short prefixes still have grams
+GRAM_SIZE = 3
+
+# Arrays of the index, each one is a .npy file opened with mmap_mode='r'
+ARRAYS = ('idf', 'postings', 'posting_offsets', 'norms')
+
+NOT_WORD = re.compile(r'[^a-z0-9]+')
+
+def normalize_title(title):
+    """
+    Normalizing a title or a query, lowercase words of letters and digits only.
+
+    Args:
+        title (str): title or query.
+
+    Returns:
+        words (array): words of the title.
+    """
+    return NOT_WORD.sub(' ', str(title).lower()).split()
+
+def title_grams(title, prefix=False):
+    """
+    Creating the character n-grams of a title, every word is padded in front and behind.
+
+    Args:
+        title (str): title or query.
+        prefix (bool): the last word is unfinished, it is not padded behind so it matches longer words.
+
+    Returns:
+        grams (array): distinct n-grams of the title, in order of appearance.
+    """
+    words = normalize_title(title)
+    grams = {}
+    for pos, word in enumerate(words):
+        padded = ' ' * (GRAM_SIZE - 1) + word + ('' if prefix and pos == len(words) - 1 else ' ')
+        for i in range(len(padded) - GRAM_SIZE + 1):
+            grams.setdefault(padded[i:i + GRAM_SIZE], None)
+    return list(grams)
+
+def build_title_index(titles):
+    """
+    Building the index of the titles.
+
+    Args:
+        titles (array): title of every fiction.
+
+    Returns:
+        index (dict): the index.
+    """
+    vocabulary, rows = {}, []
+    for title in titles:
+        rows.append([vocabulary.setdefault(gram, len(vocabulary)) for gram in title_grams(title)])
+
+    # Posting lists sorted by gram, then by title position
+    cols = np.fromiter((col for row in rows for col in row), dtype=np.int64, count=sum(map(len, rows)))
+    positions = np.repeat(np.arange(len(rows), dtype=np.int32), [len(row) for row in rows])
+    order = np.argsort(cols, kind='stable')
+    counts = np.bincount(cols, minlength=len(vocabulary))
+    posting_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(counts, out=posting_offsets[1:])
+
+    idf = np.log((1 + len(rows)) / (1 + counts)) + 1
+    norms = np.sqrt(np.bincount(positions, weights=idf[cols] ** 2, minlength=len(rows)))
+    norms[norms == 0] = 1
+    return {'vocabulary': vocabulary, 'idf': idf, 'postings': positions[order],
+            'posting_offsets': posting_offsets, 'norms': norms}
+
+def write_title_index(index_dir, index):
+    """
+    Writing the index.
+
+    Args:
+        index_dir (str): directory of the index, created when missing.
+        index (dict): the index.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(index_dir, name + '.npy'), index[name])
+    with open(os.path.join(index_dir, 'grams.json'), 'w', encoding='utf-8') as f:
+        json.dump(index['vocabulary'], f)
+
+def open_title_index(index_dir):
+    """
+    Opening the index, the arrays are memory-mapped read-only.
+
+    Args:
+        index_dir (str): directory of the index.
+
+    Returns:
+        index (dict): the index, None if it does not exist.
+    """
+    try:
+        with open(os.path.join(index_dir, 'grams.json'), encoding='utf-8') as f:
+            index = {'vocabulary': json.load(f)}
+    except FileNotFoundError:
+        return None
+    for name in ARRAYS:
+        index[name] = np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r')
+    return index
+
+def title_scores(index, query, prefix=True):
+    """
+    Scoring every title against the query, cosine similarity of the IDF weighted n-grams.
+
+    Args:
+        index (dict): the index.
+        query (str): text typed by the user.
+        prefix (bool): the last word of the query may be unfinished.
+
+    Returns:
+        scores (np.ndarray): score of every title, 0 when no n-gram is shared.
+    """
+    grams = title_grams(query, prefix)
+    cols = [index['vocabulary'][gram] for gram in grams if gram in index['vocabulary']]
+    scores = np.zeros(len(index['norms']))
+    if not cols:
+        return scores
+
+    # Only the posting lists of the query grams are read
+    offsets = index['posting_offsets']
+    idf = np.asarray(index['idf'][cols])
+    postings = [index['postings'][offsets[col]:offsets[col + 1]] for col in cols]
+    weights = np.repeat(idf ** 2, [len(posting) for posting in postings])
+    scores = np.bincount(np.concatenate(postings), weights=weights, minlength=len(scores))
+
+    # Query grams missing from the index count in the query norm with the IDF of an unseen gram, misspellings score lower
+    unseen = np.log(1 + len(scores)) + 1
+    query_norm = np.sqrt((idf ** 2).sum() + (len(grams) - len(cols)) * unseen ** 2)
+    return scores / (np.asarray(index['norms']) * query_norm)
+
+def title_candidates(index, query, top_n=10, prefix=True):
+    """
+    Finding the best matching titles of the query.
+
+    Args:
+        index (dict): the index.
+        query (str): text typed by the user.
+        top_n (int): number of candidates.
+        prefix (bool): the last word of the query may be unfinished.
+
+    Returns:
+        positions (np.ndarray): positions of the best matching titles, best first (ties keep the title order).
+        scores (np.ndarray): score of each of those titles.
+    """
+    scores = title_scores(index, query, prefix)
+    top_n = min(top_n, int(np.count_nonzero(scores)))
+    if top_n <= 0:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    top = top[np.lexsort((top, -scores[top]))]
+    return top, scores[top]
+
+# Check: python search_title_index.py
+if __name__ == "__main__":
+    index = build_title_index(['Golden Dragon', 'The Gold Coast', 'Silver Moon', 'Gone Girl'])
+    for query in ('gold', 'goldn', 'golden dragn', 'silvr', 'g'):
+        positions, scores = title_candidates(index, query, 3)
+        print(query, list(zip(positions.tolist(), np.round(scores, 3).tolist())))